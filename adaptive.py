@@ -0,0 +1,33 @@
+from collections import deque
+from typing import Deque
+
+
+class AdaptiveDelay:
+    # the first-key delay only has to cover the user's rolls: the time between pressing
+    # a key and releasing the dual-role key in sequences that were meant as a tap.
+    # the delay follows a high quantile of the recent overlaps, never above the configured one.
+    #
+    # overlaps are observed from rolls that came out as taps and from rolls the delay
+    # missed (the timer fired and the dual-role key was released before the other key),
+    # so the estimate can grow back as well as shrink
+
+    WINDOW = 64
+    MIN_SAMPLES = 16
+    QUANTILE = 0.95
+    MARGIN = 1.25
+    FLOOR = 0.01
+
+    def __init__(self, ceiling: float):
+        self.ceiling = ceiling
+        self.delay = ceiling
+        self._overlaps: Deque[float] = deque(maxlen=self.WINDOW)
+
+    def observe(self, overlap: float) -> float:
+        self._overlaps.append(overlap)
+
+        if len(self._overlaps) >= self.MIN_SAMPLES:
+            ordered = sorted(self._overlaps)
+            quantile = ordered[int(self.QUANTILE * (len(ordered) - 1))]
+            self.delay = min(self.ceiling, max(self.FLOOR, quantile * self.MARGIN))
+
+        return self.delay
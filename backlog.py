@@ -0,0 +1,90 @@
+import time
+from typing import Dict, List, Tuple
+
+from evdev import InputEvent, KeyEvent, ecodes
+
+
+# a read whose oldest event is this old means the loop fell behind the device
+BACKLOG_THRESHOLD = 0.05
+
+
+def behind(timestamp: float) -> bool:
+    # `timestamp` of the oldest event of a read
+    return time.time() - timestamp > BACKLOG_THRESHOLD
+
+
+def _frames(events: List[InputEvent]) -> List[List[InputEvent]]:
+    frames = [[]]
+    for event in events:
+        frames[-1].append(event)
+        if event.type == ecodes.EV_SYN and event.code == ecodes.SYN_REPORT:
+            frames.append([])
+
+    if not frames[-1]:
+        frames.pop()
+    return frames
+
+
+def _is_stale_repeat(frame: List[InputEvent], later_keys: set) -> bool:
+    # only autorepeats of keys that change again later in the read
+    repeats = False
+    for event in frame:
+        if event.type == ecodes.EV_KEY:
+            if event.value != KeyEvent.key_hold or event.code not in later_keys:
+                return False
+            repeats = True
+        elif event.type not in (ecodes.EV_MSC, ecodes.EV_SYN):
+            return False
+    return repeats
+
+
+def _is_motion(frame: List[InputEvent]) -> bool:
+    # multitouch frames aren't: their axes only mean something after the ABS_MT_SLOT before them
+    last = frame[-1]
+    if last.type != ecodes.EV_SYN or last.code != ecodes.SYN_REPORT:
+        return False
+    return all(
+        event.type == ecodes.EV_REL or event.type == ecodes.EV_ABS and event.code < ecodes.ABS_MT_SLOT
+        for event in frame[:-1]
+    )
+
+
+def _merge_motion(into: List[InputEvent], frame: List[InputEvent]):
+    # relative axes add up, absolute ones keep the last position
+    by_code: Dict[Tuple[int, int], InputEvent] = {(e.type, e.code): e for e in into[:-1]}
+    motion = into[:-1]
+
+    for event in frame[:-1]:
+        previous = by_code.get((event.type, event.code))
+        if previous is None:
+            by_code[event.type, event.code] = event
+            motion.append(event)
+            continue
+
+        previous.sec, previous.usec = event.sec, event.usec
+        previous.value = previous.value + event.value if event.type == ecodes.EV_REL else event.value
+
+    into[:] = motion + frame[-1:]
+
+
+def coalesce(events: List[InputEvent]) -> List[InputEvent]:
+    # drops autorepeat frames superseded later in the read and merges runs of
+    # pointer-only frames; key presses and releases are never touched
+    frames = _frames(events)
+
+    kept = []
+    later_keys = set()
+    for frame in reversed(frames):
+        if not _is_stale_repeat(frame, later_keys):
+            kept.append(frame)
+        later_keys.update(event.code for event in frame if event.type == ecodes.EV_KEY)
+    kept.reverse()
+
+    merged: List[List[InputEvent]] = []
+    for frame in kept:
+        if merged and _is_motion(frame) and _is_motion(merged[-1]):
+            _merge_motion(merged[-1], frame)
+        else:
+            merged.append(frame)
+
+    return [event for frame in merged for event in frame]
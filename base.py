@@ -1,6 +1,34 @@
 import asyncio
+import os
+import struct
+import time
+from typing import Dict, FrozenSet, List, Optional
 
-from evdev import InputDevice, InputEvent, UInput
+from evdev import InputDevice, InputEvent, UInput, ecodes
+
+import latency
+import metrics
+import tracing
+from clock import Clock, default_clock
+
+
+# struct input_event: timeval, type, code, value
+input_event = struct.Struct('llHHi')
+_SYN_REPORT = input_event.pack(0, 0, ecodes.EV_SYN, ecodes.SYN_REPORT, 0)
+
+
+# input_event records read at once by the raw reader
+RAW_BATCH = 64
+
+
+def layer_label(device: str, name: str) -> str:
+    # how a stage shows up in traces, latency histograms and profiles
+    return '%s:%s' % (device, name) if device else name
+
+
+def _set_ready(fut: asyncio.Future):
+    if not fut.done():
+        fut.set_result(None)
 
 
 class InputDeviceReader:
@@ -19,6 +47,12 @@ class InputDeviceReader:
             self._fut.set_exception(StopAsyncIteration)
 
     async def reader(self):
+        async for events in self.batches():
+            for event in events:
+                yield event
+
+    async def batches(self):
+        # yields the events of every read at once
         with self._dev.grab_context():
             while True:
                 if self._closed:
@@ -27,34 +61,245 @@ class InputDeviceReader:
                 self._fut = self._dev.async_read()
 
                 try:
-                    for event in await self._fut:
-                        yield event
+                    # `async_read` resolves to a generator, the device is only read when it's consumed
+                    events = list(await self._fut)
                 except StopAsyncIteration:
                     asyncio.get_event_loop().remove_reader(self._dev.fileno())
                     break
+                except asyncio.CancelledError:
+                    asyncio.get_event_loop().remove_reader(self._dev.fileno())
+                    raise
+                except BlockingIOError:
+                    continue
+
+                yield events
+
+    async def raw_reader(self):
+        # yields views of struct input_event records read into one reusable buffer,
+        # a view is only valid until the next iteration
+        loop = asyncio.get_event_loop()
+        fd = self._dev.fileno()
+        buf = bytearray(input_event.size * RAW_BATCH)
+        view = memoryview(buf)
+
+        with self._dev.grab_context():
+            while not self._closed:
+                self._fut = loop.create_future()
+                loop.add_reader(fd, _set_ready, self._fut)
+
+                try:
+                    await self._fut
+                except StopAsyncIteration:
+                    break
+                finally:
+                    loop.remove_reader(fd)
+
+                try:
+                    size = os.readv(fd, [buf])
+                except BlockingIOError:
+                    continue
+
+                yield view[:size]
 
 
 class AbstractLayer:
+    __slots__ = ()
 
     def send(self, event: InputEvent):
         raise NotImplemented
 
+    def send_batch(self, events: List[InputEvent]):
+        # the events of a read, in order; layers without a batch path take them one by one
+        for event in events:
+            self.send(event)
+
 
 class ModLayer(AbstractLayer):
+    __slots__ = ('out', 'clock', '_trace', '_latency', '_metrics')
+
+    # config options and their kinds (see `config.KINDS`)
+    options: Dict[str, str] = {}
+
+    # key codes the layer reacts to, `None` means all of them
+    handled_keys: Optional[FrozenSet[int]] = None
+
+    # event types besides EV_KEY the layer reacts to, events of other types go around it
+    handled_types: FrozenSet[int] = frozenset()
+
+    def keymap(self) -> Optional[Dict[int, int]]:
+        # stateless layers return their code mapping so it can be compiled
+        return None
 
     def configure(self, **kwargs):
         ...
 
-    def __init__(self, out: AbstractLayer, **kwargs):
+    def __init__(
+        self,
+        out: AbstractLayer,
+        clock: Optional[Clock] = None,
+        device: str = '',
+        name: Optional[str] = None,
+        **kwargs,
+    ):
+        # `name` is the place in the device's stack (see `compile_pipeline`): the stacks built
+        # on reloads and reconnects share the instrumentation of the layers they replace
+        name = name or type(self).__name__
+        label = layer_label(device, name)
+
         self.out = out
+        self.clock = clock or default_clock
+        self._trace = tracing.tracer(label)
+        self._latency = latency.tagger(label)
+        self._metrics = metrics.counters(device, name)
         self.configure(**kwargs)
 
+    def _instrument(self, event: InputEvent, outcome: Optional[str] = None):
+        # the optional hooks for an event the layer writes, `outcome` as in `latency`
+        if self._trace:
+            self._trace(event)
+
+        if outcome and self._latency:
+            self._latency(outcome, event)
+
+        if self._metrics:
+            self._metrics.events[outcome or latency.PASSTHROUGH] += 1
+
+    def _emit(self, event: InputEvent, outcome: Optional[str] = None):
+        self._instrument(event, outcome)
+        self.out.send(event)
+
 
 class EventWriter(AbstractLayer):
+    __slots__ = (
+        'ui', 'batch', 'written', 'write_errors',
+        '_trace', '_latency', '_frame', '_frame_keys', '_frame_events', '_flush_handle', '_unwritten', '_reading',
+    )
 
-    def __init__(self, ui: UInput):
+    def __init__(self, ui: UInput, batch: bool = False, device: str = ''):
         self.ui = ui
+        self.batch = batch
+        self._flush_handle: Optional[asyncio.Handle] = None
+
+        # set while the events of a read are dispatched, their SYN_REPORT closes the frame
+        self._reading = False
+
+        # always counted, read by the metrics endpoint
+        self.written = 0
+        self.write_errors = 0
+
+        self._trace = tracing.tracer(layer_label(device, type(self).__name__))
+        self._latency = latency.stats
+
+        # packed events of the frame being built, the keys it touches and its non-SYN events
+        self._frame = []
+        self._frame_keys = set()
+        self._frame_events = 0
+
+        # (layer, outcome) and input timestamp of the events not written yet
+        self._unwritten = []
 
     def send(self, event: InputEvent):
-        self.ui.write_event(event)
-        self.ui.syn()
+        if self._trace:
+            self._trace(event)
+
+        if self.batch:
+            self.write(event.sec, event.usec, event.type, event.code, event.value, event)
+            return
+
+        if self._latency is not None and event.type != ecodes.EV_SYN:
+            self._unwritten.append((self._latency.take(event), event.sec + event.usec * 1e-6))
+
+        try:
+            self.ui.write_event(event)
+            if event.type != ecodes.EV_SYN:
+                self.ui.syn()
+                self.written += 1
+        except OSError:
+            self.write_errors += 1
+            raise
+
+        if self._unwritten:
+            self._observe_latency()
+
+    def send_batch(self, events: List[InputEvent]):
+        if not self.batch:
+            return super().send_batch(events)
+
+        trace = self._trace
+        write = self.write
+
+        for event in events:
+            if trace:
+                trace(event)
+            write(event.sec, event.usec, event.type, event.code, event.value, event)
+
+    def _observe_latency(self):
+        now = time.time()
+
+        for key, timestamp in self._unwritten:
+            self._latency.observe(key, now - timestamp)
+
+        self._unwritten.clear()
+
+    def write(self, sec: int, usec: int, etype: int, code: int, value: int, event: Optional[InputEvent] = None):
+        # batched output of one decoded input_event, the raw pipeline calls it directly;
+        # `event` is the object the layers passed on, when there is one
+        if etype == ecodes.EV_SYN:
+            # the device's SYN_REPORT closes the frame, other SYN_* (SYN_MT_REPORT) are part of it
+            if code == ecodes.SYN_REPORT:
+                self.flush()
+                return
+        else:
+            if self._latency is not None:
+                self._unwritten.append((self._latency.take(event), sec + usec * 1e-6))
+
+            if etype == ecodes.EV_KEY:
+                # a key changing twice (e.g. a synthesized tap) needs a frame of its own
+                if code in self._frame_keys:
+                    self._frame.append(_SYN_REPORT)
+                    self._frame_keys.clear()
+                self._frame_keys.add(code)
+
+            self._frame_events += 1
+
+        self._frame.append(input_event.pack(sec, usec, etype, code, value))
+
+        # events emitted outside of a device frame (timers, macros) get flushed on the next loop iteration
+        if not self._reading and self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_soon(self._flush_soon)
+
+    def begin_read(self):
+        self._reading = True
+
+    def end_read(self):
+        self._reading = False
+
+        # a read that didn't end with a SYN_REPORT
+        if self._frame and self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_soon(self._flush_soon)
+
+    def _flush_soon(self):
+        self._flush_handle = None
+        self.flush()
+
+    def flush(self):
+        if not self._frame:
+            return
+
+        frame = self._frame
+        events, self._frame_events = self._frame_events, 0
+        frame.append(_SYN_REPORT)
+
+        try:
+            os.write(self.ui.fd, b''.join(frame))
+        except OSError:
+            self.write_errors += 1
+            raise
+        finally:
+            frame.clear()
+            self._frame_keys.clear()
+
+        self.written += events
+
+        if self._unwritten:
+            self._observe_latency()
@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import List, Tuple
+
+from evdev import InputEvent, ecodes
+
+from clock import VirtualClock
+from dual_role import DualRoleFn
+from dual_role_layer import DualRoleSwitchLayer
+from dual_role_modifier import DualRoleMod
+from pipeline import compile_pipeline
+from remap_layer import RemapLayer
+from replay import EventSink, read_events, replay
+from tap_hold import TapHoldLayer
+
+
+TRecord = Tuple[int, int, int, int, int]
+
+_LETTERS = [ecodes.ecodes['KEY_%s' % c] for c in 'QWERTYUIOPASDFGHJKLZXCVBNM']
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'configs', 'bow.json')) as _f:
+    _CODES = json.load(_f)['layers'][1]['codes']
+
+
+_HOME_ROW_MODS = {
+    ecodes.ecodes[k]: ecodes.ecodes[m] for k, m in (
+        ('KEY_A', 'KEY_LEFTMETA'), ('KEY_S', 'KEY_LEFTALT'), ('KEY_D', 'KEY_LEFTCTRL'), ('KEY_F', 'KEY_LEFTSHIFT'),
+        ('KEY_J', 'KEY_RIGHTSHIFT'), ('KEY_K', 'KEY_RIGHTCTRL'), ('KEY_L', 'KEY_RIGHTALT'),
+        ('KEY_SEMICOLON', 'KEY_RIGHTMETA'),
+    )
+}
+
+
+def _dual_role_mod(out, clock=None, **kwargs):
+    return DualRoleMod(ecodes.KEY_A, ecodes.KEY_LEFTMETA, out, clock, **kwargs)
+
+
+STACKS = {
+    'passthrough': [],
+    'RemapLayer': [(RemapLayer, {'codes': _CODES})],
+    'DualRoleSwitchLayer': [(DualRoleSwitchLayer, {'codes': _CODES})],
+    'DualRoleFn': [(DualRoleFn, {})],
+    'DualRoleMod': [(_dual_role_mod, {})],
+    'TapHold': [(TapHoldLayer, {'mods': _HOME_ROW_MODS, 'fn_layers': {ecodes.KEY_SPACE: _CODES}})],
+}
+
+
+def synthetic_corpus(keys: int, seed: int = 0) -> List[TRecord]:
+    # letters typed one by one with a space-chord (space + J) every ~10 keys
+    rnd = random.Random(seed)
+    records = []
+    t = 1_000_000.0
+
+    def frame(code, value):
+        nonlocal t
+        t += rnd.uniform(0.01, 0.08)
+        sec, usec = int(t), int(t % 1 * 1_000_000)
+
+        records.append((sec, usec, ecodes.EV_MSC, ecodes.MSC_SCAN, code))
+        records.append((sec, usec, ecodes.EV_KEY, code, value))
+        records.append((sec, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    for _ in range(keys):
+        if rnd.random() < 0.1:
+            frame(ecodes.KEY_SPACE, 1)
+            frame(ecodes.KEY_J, 1)
+            frame(ecodes.KEY_J, 0)
+            frame(ecodes.KEY_SPACE, 0)
+        else:
+            code = rnd.choice(_LETTERS)
+            frame(code, 1)
+            frame(code, 0)
+
+    return records
+
+
+def run_stack(stack, records: List[TRecord]) -> float:
+    # layers modify events in place, every run gets fresh ones;
+    # the timers run on the recorded time so timing heavy stacks go at full speed too
+    events = [InputEvent(*r) for r in records]
+    sink = EventSink()
+    clock = VirtualClock()
+
+    async def _run():
+        pipeline = compile_pipeline(stack, sink, clock)
+        started = time.perf_counter()
+        await replay(events, pipeline, clock=clock)
+        return time.perf_counter() - started
+
+    return asyncio.run(_run())
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench', description='hardware-free throughput of the layers')
+    parser.add_argument('--keys', type=int, default=20_000, help='keystrokes in the synthetic corpus')
+    parser.add_argument('--recording', help='benchmark a file written by `kbfn --record` instead')
+    parser.add_argument('--repeat', type=int, default=3, help='best of REPEAT runs')
+    args = parser.parse_args()
+
+    if args.recording:
+        records = [(e.sec, e.usec, e.type, e.code, e.value) for e in read_events(args.recording)]
+    else:
+        records = synthetic_corpus(args.keys)
+
+    baseline = None
+    print('%-22s %10s %12s %10s %10s' % ('stack', 'events', 'events/s', 'ns/event', 'layer ns'))
+
+    for name, stack in STACKS.items():
+        elapsed = min(run_stack(stack, records) for _ in range(args.repeat))
+        per_event = elapsed / len(records) * 1e9
+
+        if baseline is None:
+            baseline = per_event
+
+        print('%-22s %10d %12.0f %10.0f %10.0f' % (
+            name, len(records), len(records) / elapsed, per_event, per_event - baseline,
+        ))
+
+
+if __name__ == '__main__':
+    main()
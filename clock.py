@@ -0,0 +1,116 @@
+import asyncio
+import heapq
+import itertools
+import select
+import time
+from typing import List, Optional
+
+
+class Timer:
+    __slots__ = ('when', 'seq', 'callback', 'args', 'cancelled', 'handle')
+
+    def __init__(self, when: float, seq: int, callback, args: tuple):
+        self.when = when
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+    def __lt__(self, other: 'Timer') -> bool:
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    def cancel(self):
+        self.cancelled = True
+        if self.handle:
+            self.handle.cancel()
+            self.handle = None
+
+
+class Clock:
+    # timers shared by all the layers, deadlines are expressed in event time.
+    #
+    # the readers call `advance(event.timestamp())` before dispatching an event so timers
+    # that were due before it fire first, even when the loop is behind and events queued up.
+    # a timer firing from the loop waits while a watched device has input queued: the reader
+    # gets to those events first, they may be older than the timer
+
+    def __init__(self):
+        self.timers: List[Timer] = []
+        self._seq = itertools.count()
+        self._inputs = select.poll()
+        self._watched = 0
+
+    def watch(self, fd: int):
+        self._inputs.register(fd, select.POLLIN)
+        self._watched += 1
+
+    def unwatch(self, fd: int):
+        self._inputs.unregister(fd)
+        self._watched -= 1
+
+    def now(self) -> float:
+        # same time base as `InputEvent.timestamp()` (CLOCK_REALTIME)
+        return time.time()
+
+    def call_later(self, delay: float, callback, *args) -> Timer:
+        return self.call_at(self.now() + delay, callback, *args)
+
+    def call_at(self, timestamp: float, callback, *args) -> Timer:
+        timer = Timer(timestamp, next(self._seq), callback, args)
+        heapq.heappush(self.timers, timer)
+        self._schedule(timer)
+        return timer
+
+    def _schedule(self, timer: Timer):
+        loop = asyncio.get_event_loop()
+        timer.handle = loop.call_at(loop.time() + timer.when - self.now(), self._due, timer.when)
+
+    def _due(self, timestamp: float):
+        if self._watched and self._inputs.poll(0):
+            asyncio.get_event_loop().call_soon(self._due, timestamp)
+            return
+
+        self.advance(timestamp)
+
+    def _fire(self, timer: Timer):
+        timer.handle = None
+        timer.callback(*timer.args)
+
+    def advance(self, timestamp: float):
+        timers = self.timers
+        while timers and timers[0].when <= timestamp:
+            timer = heapq.heappop(timers)
+            if not timer.cancelled:
+                self._fire(timer)
+
+
+class VirtualClock(Clock):
+    # time only moves when `advance` is called, with the timestamps of the events fed in:
+    # recorded typing goes through the timers as fast as the layers run, the same way every time
+
+    def __init__(self, start: float = 0.0):
+        super().__init__()
+        self._now = start
+
+    def now(self) -> float:
+        return self._now
+
+    def _schedule(self, timer: Timer):
+        pass
+
+    def _fire(self, timer: Timer):
+        self._now = max(self._now, timer.when)
+        super()._fire(timer)
+
+    def advance(self, timestamp: float):
+        super().advance(timestamp)
+        self._now = max(self._now, timestamp)
+
+    def run_pending(self):
+        # fires everything still scheduled, e.g. at the end of a replay
+        while self.timers:
+            self.advance(max(timer.when for timer in self.timers))
+
+
+default_clock = Clock()
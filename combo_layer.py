@@ -0,0 +1,147 @@
+from itertools import combinations
+from typing import Dict, List, Optional, Set
+
+from evdev import InputEvent, KeyEvent, ecodes
+
+import latency
+from base import AbstractLayer, ModLayer
+from clock import Clock, Timer
+from keystate import KeyState
+
+
+COMBO_WINDOW = 0.05
+
+
+def _code(name: str) -> int:
+    name = name.strip()
+    return int(name) if name.isdigit() else ecodes.ecodes[name]
+
+
+class ComboLayer(ModLayer):
+    # keys pressed together within `window` seconds produce another key (J+K -> ESC);
+    # every combo key gets a bit, so matching the keys pressed so far is one dict lookup
+    __slots__ = (
+        '_window', '_bits', '_combos', '_prefixes', 'keys', '_consumed',
+        '_mask', '_pending', '_timer',
+    )
+
+    options = {'combos': 'combos', 'window': 'timeout'}
+
+    _window: float
+
+    # bit of every combo key, output code by combo mask, and the masks that can still grow into a combo
+    _bits: Dict[int, int]
+    _combos: Dict[int, int]
+    _prefixes: Set[int]
+
+    # combo outputs pressed downstream
+    keys: KeyState
+
+    # keys of a fired combo and the output they release
+    _consumed: Dict[int, int]
+
+    _mask: int
+    _pending: List[InputEvent]
+    _timer: Optional[Timer]
+
+    def __init__(self, out: AbstractLayer, clock: Optional[Clock] = None, **kwargs):
+        super().__init__(out, clock, **kwargs)
+
+        self.keys = KeyState()
+        self._consumed = {}
+
+        self._mask = 0
+        self._pending = []
+        self._timer = None
+
+    def configure(self, combos=None, window=COMBO_WINDOW):
+        self._window = window
+        self._bits = {}
+        self._combos = {}
+        self._prefixes = set()
+
+        for keys, out in (combos or {}).items():
+            codes = [_code(k) for k in keys.split('+')]
+            out = _code(out) if isinstance(out, str) else out
+
+            for code in codes:
+                self._bits.setdefault(code, 1 << len(self._bits))
+
+            self._combos[sum(self._bits[code] for code in set(codes))] = out
+
+            for size in range(1, len(codes)):
+                for subset in combinations(set(codes), size):
+                    self._prefixes.add(sum(self._bits[code] for code in subset))
+
+    def _expired(self):
+        self._timer = None
+        self._resolve()
+
+    def _resolve(self):
+        # the keys pressed so far either complete a combo or go out as they are
+        mask, self._mask = self._mask, 0
+        pending, self._pending = self._pending, []
+
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        out = self._combos.get(mask)
+        if out is None:
+            for event in pending:
+                self._emit(event, latency.DELAYED)
+            return
+
+        first = pending[0]
+        for event in pending:
+            self._consumed[event.code] = out
+
+        self.keys.press(out)
+        self._emit(InputEvent(first.sec, first.usec, ecodes.EV_KEY, out, KeyEvent.key_down), latency.REMAPPED)
+
+    def _release_consumed(self, event: InputEvent):
+        out = self._consumed.pop(event.code)
+
+        # the first key released ends the combo
+        if out in self.keys:
+            self.keys.release(out)
+            self._emit(InputEvent(event.sec, event.usec, ecodes.EV_KEY, out, KeyEvent.key_up), latency.REMAPPED)
+
+    def send(self, event: InputEvent):
+        if event.type != ecodes.EV_KEY:
+            self._emit(event)
+            return
+
+        code = event.code
+
+        if code in self._consumed:
+            if event.value == KeyEvent.key_up:
+                self._release_consumed(event)
+            return
+
+        bit = self._bits.get(code, 0) if event.value == KeyEvent.key_down else 0
+
+        if self._pending:
+            mask = self._mask | bit
+            if bit and not self._mask & bit and (mask in self._prefixes or mask in self._combos):
+                self._mask = mask
+                self._pending.append(event)
+                if mask not in self._prefixes:
+                    self._resolve()
+                return
+
+            self._resolve()
+
+            # the combo took the key over while it was pending
+            if code in self._consumed:
+                if event.value == KeyEvent.key_up:
+                    self._release_consumed(event)
+                return
+
+        if bit:
+            self._mask = bit
+            self._pending.append(event)
+            self._timer = self.clock.call_at(event.timestamp() + self._window, self._expired)
+            return
+
+        self._emit(event)
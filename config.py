@@ -0,0 +1,266 @@
+import hashlib
+import json
+import logging
+import marshal
+import math
+import os
+from typing import Callable, Dict, Type
+
+from evdev import ecodes
+
+from base import ModLayer
+
+
+# bump when the compiled format or the validation rules change
+FORMAT_VERSION = 2
+
+_logger = logging.getLogger(__name__)
+
+
+class ConfigError(Exception):
+    pass
+
+
+def _evdev_version() -> str:
+    try:
+        from importlib.metadata import version
+        return version('evdev')
+    except Exception:
+        return ''
+
+
+def _cache_dir() -> str:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'kbfn')
+
+
+def _key(value, where: str) -> int:
+    if isinstance(value, str):
+        code = ecodes.ecodes.get(value) if value.startswith(('KEY_', 'BTN_')) else None
+        if code is None:
+            raise ConfigError('%s: unknown key %r' % (where, value))
+    elif isinstance(value, int) and not isinstance(value, bool):
+        code = value
+    else:
+        raise ConfigError('%s: expected a key name, got %r' % (where, value))
+
+    if not 0 <= code < ecodes.KEY_CNT:
+        raise ConfigError('%s: %r is not a key' % (where, value))
+
+    return code
+
+
+def _keymap(value, where: str) -> Dict[int, int]:
+    if not isinstance(value, dict):
+        raise ConfigError('%s: expected an object, got %r' % (where, value))
+
+    return {_key(k, where): _key(v, '%s.%s' % (where, k)) for k, v in value.items()}
+
+
+def _keymaps(value, where: str) -> Dict[int, Dict[int, int]]:
+    if not isinstance(value, dict):
+        raise ConfigError('%s: expected an object, got %r' % (where, value))
+
+    return {_key(k, where): _keymap(v, '%s.%s' % (where, k)) for k, v in value.items()}
+
+
+def _combos(value, where: str) -> Dict[str, int]:
+    # {"KEY_J+KEY_K": "KEY_ESC"}, the keys of a combo are stored sorted by code
+    if not isinstance(value, dict):
+        raise ConfigError('%s: expected an object, got %r' % (where, value))
+
+    combos = {}
+    for keys, out in value.items():
+        codes = sorted({_key(k.strip(), '%s.%s' % (where, keys)) for k in keys.split('+')})
+        if len(codes) < 2:
+            raise ConfigError('%s: %r needs at least two keys' % (where, keys))
+
+        combos['+'.join(map(str, codes))] = _key(out, '%s.%s' % (where, keys))
+
+    return combos
+
+
+def _macros(value, where: str) -> Dict[int, list]:
+    # {"KEY_F13": ["KEY_H", "KEY_I", "KEY_LEFTCTRL+KEY_ENTER"]}, every step is a key or a chord tapped in turn
+    if not isinstance(value, dict):
+        raise ConfigError('%s: expected an object, got %r' % (where, value))
+
+    macros = {}
+    for trigger, steps in value.items():
+        at = '%s.%s' % (where, trigger)
+        if not isinstance(steps, list):
+            raise ConfigError('%s: expected a list, got %r' % (at, steps))
+
+        macros[_key(trigger, where)] = [
+            [_key(k.strip(), '%s[%d]' % (at, i)) for k in step.split('+')] if isinstance(step, str)
+            else [_key(step, '%s[%d]' % (at, i))]
+            for i, step in enumerate(steps)
+        ]
+
+    return macros
+
+
+def _keys(value, where: str):
+    if not isinstance(value, list):
+        raise ConfigError('%s: expected a list, got %r' % (where, value))
+
+    return [_key(v, '%s[%d]' % (where, i)) for i, v in enumerate(value)]
+
+
+def _of_type(*types) -> Callable:
+    def check(value, where: str):
+        if not isinstance(value, types) or isinstance(value, bool) and bool not in types:
+            raise ConfigError('%s: expected %s, got %r' % (where, ' or '.join(t.__name__ for t in types), value))
+        return value
+
+    return check
+
+
+def _seconds(positive: bool) -> Callable:
+    number = _of_type(int, float)
+    expected = 'a positive' if positive else 'a non-negative'
+
+    def check(value, where: str):
+        value = number(value, where)
+        if not math.isfinite(value) or value < 0 or positive and value == 0:
+            raise ConfigError('%s: expected %s number of seconds, got %r' % (where, expected, value))
+        return value
+
+    return check
+
+
+# option kinds a layer can declare in `ModLayer.options`
+KINDS: Dict[str, Callable] = {
+    'key': _key,
+    'keys': _keys,
+    'keymap': _keymap,
+    'keymaps': _keymaps,
+    'combos': _combos,
+    'macros': _macros,
+    'bool': _of_type(bool),
+    'int': _of_type(int),
+    'float': _of_type(int, float),
+    # timings: `duration` may be 0, a `timeout` can't
+    'duration': _seconds(False),
+    'timeout': _seconds(True),
+    'str': _of_type(str),
+    'dict': _of_type(dict),
+    'list': _of_type(list),
+}
+
+_MATCH = {
+    'name': _of_type(str),
+    'phys': _of_type(str),
+    'uniq': _of_type(str),
+    'vendor': _of_type(int, str),
+    'product': _of_type(int, str),
+    'keys': _keys,
+}
+
+_SETTINGS = {
+    'batch_output': _of_type(bool),
+    'raw_input': _of_type(bool),
+}
+
+
+def _compile_fields(value, fields: Dict[str, Callable], where: str) -> dict:
+    if not isinstance(value, dict):
+        raise ConfigError('%s: expected an object, got %r' % (where, value))
+
+    for name in value:
+        if name not in fields:
+            raise ConfigError('%s: unknown option %r' % (where, name))
+
+    return {name: fields[name](v, '%s.%s' % (where, name)) for name, v in value.items()}
+
+
+def _compile_layer(layer, layers: Dict[str, Type[ModLayer]], where: str) -> dict:
+    if not isinstance(layer, dict) or 'type' not in layer:
+        raise ConfigError('%s: expected an object with a "type"' % where)
+
+    cls = layers.get(layer['type'])
+    if cls is None:
+        raise ConfigError('%s: unknown layer type %r' % (where, layer['type']))
+
+    options = {k: v for k, v in layer.items() if k != 'type'}
+    fields = {name: KINDS[kind] for name, kind in cls.options.items()}
+
+    return {'type': layer['type'], **_compile_fields(options, fields, where)}
+
+
+def _compile_device(device, layers: Dict[str, Type[ModLayer]], where: str) -> dict:
+    fields = {
+        'device': _of_type(str),
+        'phys': _of_type(str),
+        'match': lambda v, w: _compile_fields(v, _MATCH, w),
+        'layers': _of_type(list),
+        **_SETTINGS,
+    }
+    compiled = _compile_fields(device, fields, where)
+
+    if 'device' not in compiled and 'match' not in compiled:
+        raise ConfigError('%s: either "device" or "match" is required' % where)
+
+    compiled['layers'] = [
+        _compile_layer(layer, layers, '%s.layers[%d]' % (where, i))
+        for i, layer in enumerate(compiled.get('layers', []))
+    ]
+    return compiled
+
+
+def compile_config(config, layers: Dict[str, Type[ModLayer]]) -> dict:
+    # validates the whole config and resolves every key name to its code
+    if not isinstance(config, dict):
+        raise ConfigError('config: expected an object')
+
+    if 'devices' not in config:
+        return _compile_device(config, layers, 'config')
+
+    top = {k: v for k, v in config.items() if k not in ('devices', 'merge_output')}
+    compiled = _compile_fields(top, _SETTINGS, 'config')
+
+    if 'merge_output' in config:
+        compiled['merge_output'] = _of_type(bool)(config['merge_output'], 'config.merge_output')
+
+    devices = _of_type(list)(config['devices'], 'config.devices')
+    compiled['devices'] = [
+        _compile_device(device, layers, 'config.devices[%d]' % i) for i, device in enumerate(devices)
+    ]
+    return compiled
+
+
+def load_config(path: str, layers: Dict[str, Type[ModLayer]]) -> dict:
+    # compiled configs are cached by the hash of the file, the evdev version and the layer options
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    schema = sorted((name, sorted(cls.options.items())) for name, cls in layers.items())
+    digest = hashlib.sha256()
+    for part in (data, _evdev_version(), FORMAT_VERSION, schema):
+        digest.update(repr(part).encode())
+
+    cache_path = os.path.join(_cache_dir(), digest.hexdigest() + '.marshal')
+
+    try:
+        with open(cache_path, 'rb') as f:
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    try:
+        config = json.loads(data)
+    except ValueError as e:
+        raise ConfigError('%s: %s' % (path, e))
+
+    compiled = compile_config(config, layers)
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = '%s.%d' % (cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(compiled, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        _logger.debug('can not cache the compiled config: %s', e)
+
+    return compiled
@@ -0,0 +1,113 @@
+import logging
+import os
+import struct
+from typing import Dict, List, Optional
+
+from evdev import ecodes
+
+
+SYSFS_INPUT = '/sys/class/input'
+DEV_INPUT = '/dev/input'
+
+_LONG_BITS = struct.calcsize('l') * 8
+
+_logger = logging.getLogger(__name__)
+
+
+def _read(path: str) -> str:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def _bitmap(words: str) -> int:
+    # sysfs prints capability bitmaps as longs in hex, most significant first
+    value = 0
+    for word in words.split():
+        value = (value << _LONG_BITS) | int(word, 16)
+    return value
+
+
+class DeviceInfo:
+    # what sysfs knows about an input node, without opening the character device
+
+    def __init__(self, path: str):
+        self.path = path
+
+        device = os.path.join(SYSFS_INPUT, os.path.basename(path), 'device')
+
+        self.name = _read(os.path.join(device, 'name'))
+        self.phys = _read(os.path.join(device, 'phys'))
+        self.uniq = _read(os.path.join(device, 'uniq'))
+        self.vendor = int(_read(os.path.join(device, 'id', 'vendor')) or '0', 16)
+        self.product = int(_read(os.path.join(device, 'id', 'product')) or '0', 16)
+
+        self._ev = _bitmap(_read(os.path.join(device, 'capabilities', 'ev')))
+        self._keys = _bitmap(_read(os.path.join(device, 'capabilities', 'key')))
+
+    def has_event_type(self, etype: int) -> bool:
+        return bool(self._ev >> etype & 1)
+
+    def has_key(self, code: int) -> bool:
+        return bool(self._keys >> code & 1)
+
+    def __repr__(self):
+        return '<DeviceInfo %s %r %r %04x:%04x>' % (self.path, self.name, self.phys, self.vendor, self.product)
+
+
+def _to_int(value) -> int:
+    return int(value, 0) if isinstance(value, str) else value
+
+
+def matches(info: DeviceInfo, dev_config: dict) -> bool:
+    rules: Optional[dict] = dev_config.get('match')
+
+    if rules is None:
+        # `device` name or `phys`, the original matching
+        phys = dev_config.get('phys')
+        return info.name == dev_config.get('device') or bool(phys) and info.phys == phys
+
+    # every given rule has to hold
+    for attr in ('name', 'phys', 'uniq'):
+        if attr in rules and getattr(info, attr) != rules[attr]:
+            return False
+
+    for attr in ('vendor', 'product'):
+        if attr in rules and getattr(info, attr) != _to_int(rules[attr]):
+            return False
+
+    for key in rules.get('keys', ()):
+        if not info.has_key(ecodes.ecodes[key] if isinstance(key, str) else key):
+            return False
+
+    return True
+
+
+class DeviceIndex:
+    # cache of DeviceInfo by /dev/input path, entries are dropped on hotplug
+
+    def __init__(self):
+        self._infos: Dict[str, DeviceInfo] = {}
+
+    def paths(self) -> List[str]:
+        try:
+            names = os.listdir(SYSFS_INPUT)
+        except OSError:
+            return []
+
+        return sorted(
+            (os.path.join(DEV_INPUT, name) for name in names if name.startswith('event')),
+            key=lambda path: int(path.rsplit('event', 1)[1]),
+        )
+
+    def get(self, path: str) -> DeviceInfo:
+        info = self._infos.get(path)
+        if info is None:
+            info = self._infos[path] = DeviceInfo(path)
+            _logger.debug('%r', info)
+        return info
+
+    def invalidate(self, path: str):
+        self._infos.pop(path, None)
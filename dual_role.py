@@ -1,9 +1,12 @@
-import asyncio
 import logging
+from typing import Optional
 
 from evdev import InputEvent, KeyEvent, ecodes
 
-from base import ModLayer
+import latency
+from base import AbstractLayer, ModLayer
+from clock import Clock, Timer
+from keystate import KeyState
 
 
 MOD_THRESHOLD = 0.5
@@ -57,15 +60,33 @@ _keycodes = {
 
 
 class DualRoleFn(ModLayer):
-    is_fn_active: bool = False
-    is_fn_used: bool = False
+    __slots__ = (
+        'is_fn_active', 'is_fn_used', 'fn_activate_time', 'keys',
+        'first_fn_event', 'first_fn_event_passed', '_first_key_timer',
+    )
+
+    is_fn_active: bool
+    is_fn_used: bool
     fn_activate_time: float
 
-    pressed_keys = set()
-    release_key_codes = {}
+    keys: KeyState
+
+    first_fn_event: Optional[InputEvent]
+    first_fn_event_passed: bool
+    _first_key_timer: Optional[Timer]
 
-    first_fn_event: InputEvent = None
-    first_fn_event_passed: bool = False
+    def __init__(self, out: AbstractLayer, clock: Optional[Clock] = None, **kwargs):
+        super().__init__(out, clock, **kwargs)
+
+        self.is_fn_active = False
+        self.is_fn_used = False
+        self.fn_activate_time = 0.0
+
+        self.keys = KeyState()
+
+        self.first_fn_event = None
+        self.first_fn_event_passed = False
+        self._first_key_timer = None
 
     def activate_fn_layer(self, event: InputEvent):
         self.is_fn_active = True
@@ -74,23 +95,23 @@ class DualRoleFn(ModLayer):
         self.fn_activate_time = event.timestamp()
         self.first_fn_event = None
         self.first_fn_event_passed: bool = False
+        self._cancel_first_key_timer()
 
     def deactivate_fn_layer(self):
         self.is_fn_active = False
+        self._cancel_first_key_timer()
 
     def update_pressed_keys(self, event: InputEvent):
         if event.value == KeyEvent.key_down:
-            self.pressed_keys.add(event.code)
-        elif event.value == KeyEvent.key_up and event.code in self.pressed_keys:
-            self.pressed_keys.remove(event.code)
+            self.keys.press(event.code)
+        elif event.value == KeyEvent.key_up:
+            self.keys.release(event.code)
 
-    def _write_event(self, event: InputEvent):
+    def _write_event(self, event: InputEvent, outcome: str = None):
         if event.type == ecodes.EV_KEY:
             self.update_pressed_keys(event)
 
-            key_state = ('up', 'down', 'hold')[event.value]
-            key = ecodes.keys.get(event.code)
-            _logger.debug('write event:\t%s\t%s', key, key_state)
+        self._instrument(event, outcome)
 
         self.out.send(event)
 
@@ -101,11 +122,16 @@ class DualRoleFn(ModLayer):
             ecodes.EV_KEY,
             ecodes.KEY_SPACE,
             KeyEvent.key_down
-        ))
-        self._write_event(key_down_event)
+        ), latency.TAP)
+        self._write_event(key_down_event, latency.TAP)
+
+    def _cancel_first_key_timer(self):
+        if self._first_key_timer:
+            self._first_key_timer.cancel()
+            self._first_key_timer = None
 
-    async def _first_fn_key_press(self):
-        await asyncio.sleep(FIRST_KEY_DELAY)
+    def _first_fn_key_press(self):
+        self._first_key_timer = None
 
         _logger.debug('CALLBACK')
         if not self.is_fn_active:
@@ -113,9 +139,11 @@ class DualRoleFn(ModLayer):
 
         if not self.first_fn_event_passed:
             self.first_fn_event_passed = True
-            self._handle_fn_event(self.first_fn_event)
+            if self._metrics:
+                self._metrics.first_key_delays += 1
+            self._handle_fn_event(self.first_fn_event, latency.DELAYED)
 
-    def _handle_fn_event(self, event: InputEvent):
+    def _handle_fn_event(self, event: InputEvent, outcome: str = latency.HOLD):
         if event.type == ecodes.EV_KEY:
             key_code = event.code
 
@@ -123,10 +151,12 @@ class DualRoleFn(ModLayer):
                 return
 
             # pass the event unmodified if the key was pressed before FN layer activated
-            if key_code not in self.pressed_keys:
+            if key_code not in self.keys:
                 if not self.first_fn_event:
                     self.first_fn_event = event
-                    asyncio.create_task(self._first_fn_key_press())
+                    self._first_key_timer = self.clock.call_at(
+                        event.timestamp() + FIRST_KEY_DELAY, self._first_fn_key_press
+                    )
                     return
 
                 if not self.first_fn_event_passed:
@@ -139,10 +169,15 @@ class DualRoleFn(ModLayer):
                 event.code = _keycodes[key_code]
 
                 if event.value == KeyEvent.key_down:
-                    self.release_key_codes[key_code] = event.code
+                    self.keys.set_release_code(key_code, event.code)
+                    if self._metrics and not self.is_fn_used:
+                        self._metrics.holds += 1
                     self.is_fn_used = True
                 elif event.value == KeyEvent.key_up:
-                    self.release_key_codes.pop(key_code, None)
+                    self.keys.pop_release_code(key_code, 0)
+
+                self._write_event(event, outcome)
+                return
 
         self._write_event(event)
 
@@ -155,21 +190,24 @@ class DualRoleFn(ModLayer):
                 self.deactivate_fn_layer()
                 if not self.is_fn_used and event.timestamp() - self.fn_activate_time < MOD_THRESHOLD:
                     self._write_space(event)
+                    if self._metrics:
+                        self._metrics.taps += 1
 
                     if self.first_fn_event and not self.first_fn_event_passed:
                         if (event.timestamp() - self.first_fn_event.timestamp()) < FIRST_KEY_DELAY:
-                            self._write_event(self.first_fn_event)
+                            self._write_event(self.first_fn_event, latency.TAP)
 
         elif event.type == ecodes.EV_KEY and self.is_fn_active:
             self._handle_fn_event(event)
         elif event.type == ecodes.EV_KEY and event.value in (KeyEvent.key_up, KeyEvent.key_hold):
             # modify `event.code` if fn-layer key was released after FN layer deactivated
-            event.code = self.release_key_codes.pop(event.code, event.code)
+            key_code = event.code
+            event.code = self.keys.pop_release_code(key_code, key_code)
 
-            if event.code not in self.pressed_keys:
+            if event.code not in self.keys:
                 return
 
-            self._write_event(event)
+            self._write_event(event, latency.HOLD if event.code != key_code else None)
         else:
             self._write_event(event)
 
@@ -1,10 +1,14 @@
-import asyncio
 import logging
+from typing import List, Optional, Tuple
 
 from evdev import InputEvent, KeyEvent, ecodes
 
-from base import ModLayer
+import latency
+from adaptive import AdaptiveDelay
+from base import AbstractLayer, ModLayer
+from clock import Clock, Timer
 from helpers import convert_keycode_map
+from keystate import KeyState
 
 
 MOD_THRESHOLD = 0.5
@@ -14,21 +18,59 @@ _logger = logging.getLogger(__name__)
 
 
 class DualRoleSwitchLayer(ModLayer):
-    _keycodes: dict = None
+    __slots__ = (
+        '_keycodes', 'is_fn_active', 'is_fn_used', 'fn_activate_time', 'keys',
+        'first_fn_event', 'first_fn_event_passed', '_first_key_timer', '_batch',
+        '_mod_threshold', '_first_key_delay', '_adaptive', '_missed',
+    )
 
-    is_fn_active: bool = False
-    is_fn_used: bool = False
+    options = {'codes': 'keymap', 'mod_threshold': 'timeout', 'first_key_delay': 'timeout', 'adaptive': 'bool'}
+
+    _keycodes: dict
+
+    is_fn_active: bool
+    is_fn_used: bool
     fn_activate_time: float
 
-    pressed_keys = set()
-    release_key_codes = {}
+    # keys pressed downstream and the codes they are released as
+    keys: KeyState
+
+    first_fn_event: Optional[InputEvent]
+    first_fn_event_passed: bool
+    _first_key_timer: Optional[Timer]
+
+    # output of the batch being processed, sent on in one call
+    _batch: Optional[List[InputEvent]]
+
+    _mod_threshold: float
+    _first_key_delay: float
+    _adaptive: Optional[AdaptiveDelay]
+
+    # (code, press time) of the first key when the first-key timer made it a fn key
+    _missed: Optional[Tuple[int, float]]
 
-    first_fn_event: InputEvent = None
-    first_fn_event_passed: bool = False
+    def __init__(self, out: AbstractLayer, clock: Optional[Clock] = None, **kwargs):
+        super().__init__(out, clock, **kwargs)
+
+        self.is_fn_active = False
+        self.is_fn_used = False
+        self.fn_activate_time = 0.0
+
+        self.keys = KeyState()
+
+        self.first_fn_event = None
+        self.first_fn_event_passed = False
+        self._first_key_timer = None
+        self._batch = None
+        self._missed = None
 
-    def configure(self, codes=None):
+    def configure(self, codes=None, mod_threshold=MOD_THRESHOLD, first_key_delay=FIRST_KEY_DELAY, adaptive=False):
         self._keycodes = convert_keycode_map(codes or {})
 
+        self._mod_threshold = mod_threshold
+        self._first_key_delay = first_key_delay
+        self._adaptive = AdaptiveDelay(first_key_delay) if adaptive else None
+
     def activate_fn_layer(self, event: InputEvent):
         self.is_fn_active = True
 
@@ -36,26 +78,29 @@ class DualRoleSwitchLayer(ModLayer):
         self.fn_activate_time = event.timestamp()
         self.first_fn_event = None
         self.first_fn_event_passed: bool = False
+        self._missed = None
+        self._cancel_first_key_timer()
 
     def deactivate_fn_layer(self):
         self.is_fn_active = False
+        self._cancel_first_key_timer()
 
     def update_pressed_keys(self, event: InputEvent):
         if event.value == KeyEvent.key_down:
-            self.pressed_keys.add(event.code)
-
-        elif event.value == KeyEvent.key_up and event.code in self.pressed_keys:
-            self.pressed_keys.remove(event.code)
+            self.keys.press(event.code)
+        elif event.value == KeyEvent.key_up:
+            self.keys.release(event.code)
 
-    def _write_event(self, event: InputEvent):
+    def _write_event(self, event: InputEvent, outcome: str = None):
         if event.type == ecodes.EV_KEY:
             self.update_pressed_keys(event)
 
-            key_state = ('up', 'down', 'hold')[event.value]
-            key = ecodes.keys.get(event.code)
-            _logger.debug('write event:\t%s\t%s', key, key_state)
+        self._instrument(event, outcome)
 
-        self.out.send(event)
+        if self._batch is not None:
+            self._batch.append(event)
+        else:
+            self.out.send(event)
 
     def _write_space(self, key_down_event: InputEvent):
         self._write_event(InputEvent(
@@ -64,11 +109,16 @@ class DualRoleSwitchLayer(ModLayer):
             ecodes.EV_KEY,
             ecodes.KEY_SPACE,
             KeyEvent.key_down
-        ))
-        self._write_event(key_down_event)
+        ), latency.TAP)
+        self._write_event(key_down_event, latency.TAP)
 
-    async def _first_fn_key_press(self):
-        await asyncio.sleep(FIRST_KEY_DELAY)
+    def _cancel_first_key_timer(self):
+        if self._first_key_timer:
+            self._first_key_timer.cancel()
+            self._first_key_timer = None
+
+    def _first_fn_key_press(self):
+        self._first_key_timer = None
 
         _logger.debug('CALLBACK')
         if not self.is_fn_active:
@@ -76,9 +126,13 @@ class DualRoleSwitchLayer(ModLayer):
 
         if not self.first_fn_event_passed:
             self.first_fn_event_passed = True
-            self._handle_fn_event(self.first_fn_event)
+            if self._metrics:
+                self._metrics.first_key_delays += 1
+            if self._adaptive and self.first_fn_event.value == KeyEvent.key_down:
+                self._missed = (self.first_fn_event.code, self.first_fn_event.timestamp())
+            self._handle_fn_event(self.first_fn_event, latency.DELAYED)
 
-    def _handle_fn_event(self, event: InputEvent):
+    def _handle_fn_event(self, event: InputEvent, outcome: str = latency.HOLD):
         if event.type == ecodes.EV_KEY:
             key_code = event.code
 
@@ -86,10 +140,12 @@ class DualRoleSwitchLayer(ModLayer):
                 return
 
             # pass the event unmodified if the key was pressed before FN layer activated
-            if key_code not in self.pressed_keys:
+            if key_code not in self.keys:
                 if not self.first_fn_event:
                     self.first_fn_event = event
-                    asyncio.create_task(self._first_fn_key_press())
+                    self._first_key_timer = self.clock.call_at(
+                        event.timestamp() + self._first_key_delay, self._first_fn_key_press
+                    )
                     return
 
                 if not self.first_fn_event_passed:
@@ -102,10 +158,15 @@ class DualRoleSwitchLayer(ModLayer):
                 event.code = self._keycodes[key_code]
 
                 if event.value == KeyEvent.key_down:
-                    self.release_key_codes[key_code] = event.code
+                    self.keys.set_release_code(key_code, event.code)
+                    if self._metrics and not self.is_fn_used:
+                        self._metrics.holds += 1
                     self.is_fn_used = True
                 elif event.value == KeyEvent.key_up:
-                    self.release_key_codes.pop(key_code, None)
+                    self.keys.pop_release_code(key_code, 0)
+
+                self._write_event(event, outcome)
+                return
 
         self._write_event(event)
 
@@ -116,22 +177,50 @@ class DualRoleSwitchLayer(ModLayer):
 
             elif event.value == KeyEvent.key_up:
                 self.deactivate_fn_layer()
-                if not self.is_fn_used and event.timestamp() - self.fn_activate_time < MOD_THRESHOLD:
+                if self._missed:
+                    code, pressed = self._missed
+                    self._missed = None
+                    # space released before the key the timer made a fn key: a roll after all
+                    if self.keys.get_release_code(code, 0):
+                        self._first_key_delay = self._adaptive.observe(event.timestamp() - pressed)
+
+                if not self.is_fn_used and event.timestamp() - self.fn_activate_time < self._mod_threshold:
                     self._write_space(event)
+                    if self._metrics:
+                        self._metrics.taps += 1
 
                     if self.first_fn_event and not self.first_fn_event_passed:
-                        if (event.timestamp() - self.first_fn_event.timestamp()) < FIRST_KEY_DELAY:
-                            self._write_event(self.first_fn_event)
+                        overlap = event.timestamp() - self.first_fn_event.timestamp()
+                        if overlap < self._first_key_delay:
+                            if self._adaptive and self.first_fn_event.value == KeyEvent.key_down:
+                                self._first_key_delay = self._adaptive.observe(overlap)
+                            self._write_event(self.first_fn_event, latency.TAP)
 
         elif event.type == ecodes.EV_KEY and self.is_fn_active:
             self._handle_fn_event(event)
         elif event.type == ecodes.EV_KEY and event.value in (KeyEvent.key_up, KeyEvent.key_hold):
             # modify `event.code` if fn-layer key was released after FN layer deactivated
-            event.code = self.release_key_codes.pop(event.code, event.code)
+            key_code = event.code
+            event.code = self.keys.pop_release_code(key_code, key_code)
 
-            if event.code not in self.pressed_keys:
+            if event.code not in self.keys:
                 return
 
-            self._write_event(event)
+            self._write_event(event, latency.HOLD if event.code != key_code else None)
         else:
             self._write_event(event)
+
+    def send_batch(self, events: List[InputEvent]):
+        # the latency tags are taken per written event, they can't wait for the batch
+        if self._latency:
+            return super().send_batch(events)
+
+        self._batch = []
+        try:
+            for event in events:
+                self.send(event)
+        finally:
+            batch, self._batch = self._batch, None
+
+        if batch:
+            self.out.send_batch(batch)
@@ -0,0 +1,149 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+from typing import Callable, Optional, Set
+
+import evdev
+
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+_ADDED = IN_CREATE | IN_ATTRIB | IN_MOVED_TO
+_REMOVED = IN_DELETE | IN_MOVED_FROM
+
+# struct inotify_event: wd, mask, cookie, len, name[len]
+_inotify_event = struct.Struct('iIII')
+
+POLL_INTERVAL = 3
+
+# editors touch a file several times when saving it
+SETTLE_DELAY = 0.1
+
+_logger = logging.getLogger(__name__)
+
+
+class Inotify:
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed', path)
+        return wd
+
+    def read(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _inotify_event.unpack_from(data, offset)
+            offset += _inotify_event.size
+            name = data[offset:offset + length].rstrip(b'\0').decode()
+            offset += length
+            yield wd, mask, name
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DeviceMonitor:
+    # calls `callback(path, added)` when an /dev/input/event* node appears or goes away;
+    # uses inotify and falls back to polling `evdev.list_devices()` without it
+
+    def __init__(self, callback: Callable[[str, bool], None], path: str = '/dev/input'):
+        self._callback = callback
+        self._path = path
+        self._loop = asyncio.get_event_loop()
+
+        self._inotify: Optional[Inotify] = None
+        self._poll_handle: Optional[asyncio.TimerHandle] = None
+        self._known: Set[str] = set()
+
+        try:
+            self._inotify = Inotify()
+            self._inotify.add_watch(path, _ADDED | _REMOVED)
+        except OSError as e:
+            _logger.warning('inotify is not available (%s), polling for devices', e)
+            if self._inotify:
+                self._inotify.close()
+                self._inotify = None
+
+            self._known = set(evdev.list_devices(path))
+            self._poll_handle = self._loop.call_later(POLL_INTERVAL, self._poll)
+        else:
+            self._loop.add_reader(self._inotify.fd, self._read)
+
+    def _read(self):
+        for _wd, mask, name in self._inotify.read():
+            if name.startswith('event'):
+                self._callback(os.path.join(self._path, name), not mask & _REMOVED)
+
+    def _poll(self):
+        current = set(evdev.list_devices(self._path))
+
+        for path in current - self._known:
+            self._callback(path, True)
+        for path in self._known - current:
+            self._callback(path, False)
+
+        self._known = current
+        self._poll_handle = self._loop.call_later(POLL_INTERVAL, self._poll)
+
+    def close(self):
+        if self._inotify:
+            self._loop.remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+
+        if self._poll_handle:
+            self._poll_handle.cancel()
+            self._poll_handle = None
+
+
+class FileMonitor:
+    # calls `callback()` once a file has been written or replaced
+
+    def __init__(self, path: str, callback: Callable[[], None]):
+        self._callback = callback
+        self._name = os.path.basename(path)
+        self._loop = asyncio.get_event_loop()
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+        # watching the directory catches editors that save by renaming a new file over the old one
+        self._inotify = Inotify()
+        self._inotify.add_watch(os.path.dirname(os.path.abspath(path)), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        self._loop.add_reader(self._inotify.fd, self._read)
+
+    def _read(self):
+        for _wd, _mask, name in self._inotify.read():
+            if name == self._name:
+                if self._handle:
+                    self._handle.cancel()
+                self._handle = self._loop.call_later(SETTLE_DELAY, self._changed)
+
+    def _changed(self):
+        self._handle = None
+        self._callback()
+
+    def close(self):
+        if self._handle:
+            self._handle.cancel()
+
+        self._loop.remove_reader(self._inotify.fd)
+        self._inotify.close()
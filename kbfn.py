@@ -1,132 +1,534 @@
-import json
-import sys
+import argparse
+import errno
+import functools
 import asyncio
 import logging
 import signal
 import time
-from typing import Dict, Optional
-
-import evdev
-from evdev import InputDevice, UInput
-
-from base import AbstractLayer, EventWriter, InputDeviceReader
+from typing import Dict, List, Optional, Set, Tuple
+
+from evdev import InputDevice, InputEvent, UInput, ecodes
+
+import backlog
+import latency
+import log_queue
+import metrics
+import profiling
+import runtime
+import tracing
+from base import AbstractLayer, EventWriter, InputDeviceReader, input_event
+from combo_layer import ComboLayer
+from clock import Clock, default_clock
+from config import ConfigError, load_config
+from devices import DeviceIndex, matches
 from dual_role_layer import DualRoleSwitchLayer
+from hotplug import DeviceMonitor, FileMonitor
+from macro_layer import MacroLayer
+from pipeline import DispatchLayer, HandoverLayer, RawPipeline, compile_pipeline
 from remap_layer import RemapLayer
+from replay import Recorder
+from tap_hold import TapHoldLayer
 
 
 TLayers = Dict[int, AbstractLayer]
 logger = logging.getLogger('kbfn')
 
 
-def _get_device_by_name(name: str, phys: Optional[str] = None) -> Optional[InputDevice]:
-    for x in evdev.list_devices():
-        dev = InputDevice(x)
-
-        logger.debug('%s (%s) -> %s', dev.name, dev.phys, x)
-
-        if dev.name == name or phys and dev.phys == phys:
-            return dev
-
-
 _LAYERS = {
     "Remap": RemapLayer,
     "DualRole": DualRoleSwitchLayer,
+    "TapHold": TapHoldLayer,
+    "Combo": ComboLayer,
+    "Macro": MacroLayer,
 }
 
 
+def layer_specs(config: dict):
+    for _layer in config['layers']:
+        _layer = _layer.copy()
+        cls = _LAYERS[_layer.pop('type')]
+        yield cls, _layer
+
+
+def _same_instant(first: InputEvent, last: InputEvent) -> bool:
+    return first.sec == last.sec and first.usec == last.usec
+
+
 class KBFN:
+    _writer: EventWriter = None
+    _pipeline: AbstractLayer = None
+    _raw_pipeline: RawPipeline = None
+
+    # stack built by `reload`, swapped in at the end of the current frame
+    _next_pipeline: DispatchLayer = None
 
-    def __init__(self, dev: InputDevice, config: dict):
+    clock: Clock = default_clock
+
+    def __init__(self, dev: InputDevice, config: dict, recorder: Optional[Recorder] = None):
+        self.dev = dev
         self.input_reader = InputDeviceReader(dev)
-        self.config = config  # fixme: validate settings
+        self.events_read = 0
+        self.events_dropped = 0
+        self.config = config
+        self.recorder = recorder
+
+    async def run(self, ui: Optional[UInput] = None):
+        if ui is None:
+            with UInput() as ui:
+                return await self.run(ui)
+
+        # the raw input path writes whole frames, it needs the batched writer
+        raw_input = self.config.get('raw_input', False)
+
+        self._writer = EventWriter(
+            ui, batch=self.config.get('batch_output', False) or raw_input, device=self.dev.name,
+        )
+        self._set_pipeline(self._compile(self.config))
+        runtime.freeze()
+
+        # timers due while input is queued wait for the reader
+        fd = self.dev.fileno()
+        self.clock.watch(fd)
+        try:
+            if raw_input:
+                await self._run_raw()
+            else:
+                await self._run_events()
+        finally:
+            self.clock.unwatch(fd)
+
+    async def _run_events(self):
+        writer = self._writer
+
+        async for events in self.input_reader.batches():
+            self.events_read += len(events)
+
+            if self.recorder:
+                for event in events:
+                    self.recorder.write(event)
 
-    async def run(self):
-        with UInput() as ui:
-            writer = EventWriter(ui)
+            writer.begin_read()
+            try:
+                self._dispatch(events)
+            finally:
+                writer.end_read()
+
+    def _dispatch(self, events: List[InputEvent]):
+        if not events:
+            return
+
+        clock = self.clock
+
+        if backlog.behind(events[0].timestamp()):
+            events = self._coalesce(events)
+        elif _same_instant(events[0], events[-1]):
+            # no timer can come due in the middle of a read from one instant (usually one frame):
+            # it goes through the stack with one call per stage
+            if clock.timers:
+                clock.advance(events[0].timestamp())
+
+            self._pipeline.send_batch(events)
+            runtime.active = True
+
+            if self._next_pipeline is not None and events[-1].type == ecodes.EV_SYN:
+                self._swap_pipeline()
+            return
+
+        for event in events:
+            # timers due before the event fire first
+            if clock.timers:
+                clock.advance(event.timestamp())
+
+            self._pipeline.send(event)
+
+            if event.type == ecodes.EV_SYN:
+                runtime.active = True
+
+                if self._next_pipeline is not None:
+                    self._swap_pipeline()
+
+    def _coalesce(self, events: List[InputEvent]) -> List[InputEvent]:
+        kept = backlog.coalesce(events)
 
-            for _layer in reversed(self.config['layers']):
-                _layer = _layer.copy()
-                cls = _LAYERS[_layer.pop('type')]
-                writer = cls(writer, **_layer)
+        dropped = len(events) - len(kept)
+        if dropped:
+            self.events_dropped += dropped
+            logger.info(
+                '%s: %.0fms behind, dropped %d of %d events',
+                self.dev.path, (time.time() - events[0].timestamp()) * 1000, dropped, len(events),
+            )
 
-            # mod_layer = DualRoleSwitchLayer(out=writer)
-            # remap_layer = RemapLayer(out=mod_layer)
+        return kept
 
-            async for event in self.input_reader:
-                writer.send(event)
+    async def _run_raw(self):
+        writer = self._writer
+
+        async for data in self.input_reader.raw_reader():
+            self.events_read += len(data) // input_event.size
+
+            if self.recorder:
+                self.recorder.write_raw(data)
+
+            writer.begin_read()
+            try:
+                self._dispatch_raw(data)
+            finally:
+                writer.end_read()
+
+    def _dispatch_raw(self, data: memoryview):
+        sec, usec = input_event.unpack_from(data)[:2]
+        if backlog.behind(sec + usec / 1_000_000):
+            events = self._coalesce([InputEvent(*record) for record in input_event.iter_unpack(data)])
+            data = b''.join(input_event.pack(e.sec, e.usec, e.type, e.code, e.value) for e in events)
+
+        if self._raw_pipeline:
+            self._raw_pipeline.send_raw(data)
+        else:
+            # handing over after a reload, the events need to be objects
+            for record in input_event.iter_unpack(data):
+                event = InputEvent(*record)
+                if self.clock.timers:
+                    self.clock.advance(event.timestamp())
+                self._pipeline.send(event)
+
+        runtime.active = True
+
+        # reads end on frame boundaries
+        if self._next_pipeline is not None:
+            self._swap_pipeline()
+
+    def _compile(self, config: dict) -> DispatchLayer:
+        return compile_pipeline(layer_specs(config), self._writer, self.clock, self.dev.name)
+
+    def _set_pipeline(self, pipeline: DispatchLayer):
+        self._pipeline = pipeline
+        if self.config.get('raw_input', False):
+            self._raw_pipeline = RawPipeline(pipeline, self._writer, self.clock)
+
+    def _swap_pipeline(self):
+        new, self._next_pipeline = self._next_pipeline, None
+
+        held = set(self.dev.active_keys())
+        if not held:
+            self._set_pipeline(new)
+            return
+
+        handover = HandoverLayer(self._pipeline, new, held, lambda: self._handed_over(handover, new))
+        self._pipeline = handover
+        self._raw_pipeline = None
+
+    def _handed_over(self, handover: HandoverLayer, new: DispatchLayer):
+        # a handover nested in a newer one (reloaded again while keys were held) finishing
+        # first leaves the newer one in place, its own keys are still held
+        if self._pipeline is handover:
+            self._set_pipeline(new)
+
+    def reload(self, config: dict):
+        # the reader and the writer are kept, with the grab, the uinput device and the frame being built
+        for setting in ('raw_input', 'batch_output'):
+            if config.get(setting, False) != self.config.get(setting, False):
+                logger.warning('changing %s needs a restart', setting)
+                config = {**config, setting: self.config.get(setting, False)}
+
+        self.config = config
+
+        if self._writer is not None:
+            self._next_pipeline = self._compile(config)
+            runtime.freeze()
 
     def close(self):
         self.input_reader.close()
 
 
-class NoDeviceFound(Exception):
-    pass
+def _dump_diagnostics():
+    tracing.dump()
+    latency.dump()
+    profiling.dump()
 
 
-def watcher(config):
-    _finished = False
+def device_configs(config: dict) -> List[dict]:
+    # `devices` entries inherit the top level settings (e.g. `batch_output`)
+    if 'devices' not in config:
+        return [config]
 
-    while not _finished:
-        try:
-            runner(config)
-            _finished = True
-        except (NoDeviceFound, OSError):
-            pass
+    defaults = {k: v for k, v in config.items() if k not in ('devices', 'merge_output')}
+    return [{**defaults, **device} for device in config['devices']]
 
 
 class Watcher:
-    _finished = False
+    # attaches a KBFN to every configured device as soon as it shows up in /dev/input
+    # and detaches it when it goes away, all on one event loop
+
+    RETRY_DELAY = 3
 
-    def __init__(self, config):
+    _stopped: asyncio.Event = None
+
+    def __init__(
+        self,
+        config,
+        record: Optional[str] = None,
+        config_path: Optional[str] = None,
+        watch_config: bool = False,
+        metrics_address: Optional[str] = None,
+    ):
         self.config = config
+        self.record = record
+        self.config_path = config_path
+        self.watch_config = watch_config
+        self.metrics_address = metrics_address
+        self.reconnects = 0
+
+        self._configs = device_configs(config)
+        self._running: Dict[int, Tuple[KBFN, str]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        self._index = DeviceIndex()
+        self._ui: Optional[UInput] = None
+        self._recorder: Optional[Recorder] = None
+
+        # config indexes that had a device attached at some point
+        self._seen: Set[int] = set()
+
+        # config indexes whose device no longer matched after a reload, attached again once closed
+        self._rematch: Set[int] = set()
+
+        if metrics.stats:
+            metrics.stats.add_source(self._metric_samples)
+
+    def _metric_samples(self):
+        for kbfn, path in self._running.values():
+            labels = {'device': kbfn.dev.name, 'path': path}
+
+            yield 'kbfn_events_read_total', labels, kbfn.events_read
+            yield 'kbfn_events_coalesced_total', labels, kbfn.events_dropped
+            if kbfn._writer:
+                yield 'kbfn_events_written_total', labels, kbfn._writer.written
+                yield 'kbfn_uinput_write_errors_total', labels, kbfn._writer.write_errors
+
+        yield 'kbfn_reconnects_total', {}, self.reconnects
 
     def stop(self):
-        print('bye')
-        self._finished = True
+        logger.info('bye')
+        if self._stopped:
+            self._stopped.set()
 
     def run(self):
-        def _asd(_signal, _frame):
-            print('asd')
-            self.stop()
+        loop = asyncio.get_event_loop()
+        loop.add_signal_handler(signal.SIGINT, self.stop)
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+        loop.add_signal_handler(signal.SIGUSR1, _dump_diagnostics)
+        loop.add_signal_handler(signal.SIGHUP, self.reload)
+        loop.run_until_complete(self.watch())
+
+    def reload(self):
+        if self.config_path:
+            asyncio.ensure_future(self._reload())
+
+    async def _reload(self):
+        # parsing and validation happen off the loop, the stacks are swapped between frames
+        loop = asyncio.get_event_loop()
+        try:
+            config = await loop.run_in_executor(None, load_config, self.config_path, _LAYERS)
+        except (ConfigError, OSError) as e:
+            logger.error('reload failed: %s', e)
+            return
 
-        signal.signal(signal.SIGINT, _asd)
-        signal.signal(signal.SIGTERM, _asd)
+        if config.get('merge_output', False) != self.config.get('merge_output', False):
+            logger.warning('changing merge_output needs a restart')
 
-        while not self._finished:
-            try:
-                runner(self.config)
-                self.stop()
-            except (NoDeviceFound, OSError) as e:
-                logger.debug(e)
-                time.sleep(3)
+        logger.info('reload %s', self.config_path)
+        self.config = config
+        self._configs = device_configs(config)
 
+        for index, (kbfn, path) in list(self._running.items()):
+            if index >= len(self._configs):
+                kbfn.close()
+            elif not matches(self._index.get(path), self._configs[index]):
+                # `device`/`match` changed: the device goes back through `_attach`
+                logger.info('%s no longer matches config entry %d', path, index)
+                self._rematch.add(index)
+                kbfn.close()
+            else:
+                kbfn.reload(self._configs[index])
 
-def runner(config):
-    dev_name = config['device']
-    dev = _get_device_by_name(dev_name, config.get('phys'))
-    if not dev:
-        raise NoDeviceFound('No device found %s' % dev_name)
+        self._scan()
 
-    kbfn = KBFN(dev, config)
-    loop = asyncio.get_event_loop()
-    loop.add_signal_handler(signal.SIGINT, kbfn.close)
-    loop.add_signal_handler(signal.SIGTERM, kbfn.close)
-    loop.run_until_complete(kbfn.run())
+    async def watch(self):
+        self._stopped = asyncio.Event()
 
+        if self.config.get('merge_output', False):
+            self._ui = UInput()
+        if self.record:
+            self._recorder = Recorder(self.record)
 
-if __name__ == '__main__':
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(levelname)s %(asctime)s %(name)s %(message)s'
-    )
+        if runtime.collector:
+            runtime.collector.start()
+
+        server = await metrics.stats.serve(self.metrics_address) if metrics.stats and self.metrics_address else None
+
+        monitor = DeviceMonitor(self._on_device)
+        config_monitor = FileMonitor(self.config_path, self.reload) if self.watch_config else None
+        try:
+            self._scan()
+            await self._stopped.wait()
+        finally:
+            monitor.close()
+            if config_monitor:
+                config_monitor.close()
+
+            for kbfn, _path in self._running.values():
+                kbfn.close()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+            if self._ui:
+                self._ui.close()
+            if self._recorder:
+                self._recorder.close()
+            if runtime.collector:
+                runtime.collector.stop()
+            if server:
+                server.close()
+
+    def _scan(self):
+        for path in self._index.paths():
+            self._attach(path)
+
+    def _on_device(self, path: str, added: bool):
+        self._index.invalidate(path)
+
+        if added:
+            self._attach(path)
+            return
+
+        for kbfn, kbfn_path in list(self._running.values()):
+            if kbfn_path == path:
+                kbfn.close()
+
+    def _attach(self, path: str):
+        waiting = [i for i in range(len(self._configs)) if i not in self._running]
+        if not waiting or path in (p for _k, p in self._running.values()):
+            return
+
+        info = self._index.get(path)
+        index = next((i for i in waiting if matches(info, self._configs[i])), None)
+        if index is None:
+            return
+
+        try:
+            dev = InputDevice(path)
+        except OSError as e:
+            # udev may not have set the permissions yet, IN_ATTRIB will bring us back
+            logger.debug('%s: %s', path, e)
+            return
 
-    args = sys.argv[1:]
+        logger.info('attach %s (%s)', dev.name, path)
 
-    if not args:
-        print('usage kbfn <config.json>')
-        exit(1)
+        if index in self._seen:
+            self.reconnects += 1
+        self._seen.add(index)
 
-    with open(args[0]) as f:
-        _config = json.load(f)
+        kbfn = KBFN(dev, self._configs[index], self._recorder)
+        self._running[index] = kbfn, path
 
-    Watcher(_config).run()
+        task = asyncio.ensure_future(kbfn.run(self._ui))
+        task.add_done_callback(functools.partial(self._detached, index, dev))
+        self._tasks.add(task)
+
+    def _detached(self, index: int, dev: InputDevice, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._running.pop(index, None)
+
+        error = None if task.cancelled() else task.exception()
+        if error is not None and not isinstance(error, OSError):
+            # a bug, not the device going away: the keyboard is left unmapped
+            logger.error('%s stopped', dev.path, exc_info=error)
+        logger.info('detach %s: %s', dev.path, error or 'closed')
+
+        try:
+            dev.close()
+        except OSError:
+            pass
+
+        if index in self._rematch:
+            self._rematch.discard(index)
+            if not self._stopped.is_set():
+                self._scan()
+            return
+
+        # the device is still there (e.g. grabbed by someone else): try again later
+        if isinstance(error, OSError) and error.errno != errno.ENODEV and not self._stopped.is_set():
+            asyncio.get_event_loop().call_later(self.RETRY_DELAY, self._scan)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='kbfn')
+    parser.add_argument('config', help='path to config.json')
+    parser.add_argument('--debug', action='store_true', help='enable debug logging')
+    parser.add_argument(
+        '--trace', type=int, default=0, metavar='SIZE',
+        help='keep the last SIZE events written by the layers, dumped to stderr on SIGUSR1',
+    )
+    parser.add_argument('--record', metavar='FILE', help='append the raw input events to FILE')
+    parser.add_argument(
+        '--watch', action='store_true',
+        help='reload the config when the file changes (SIGHUP always reloads it)',
+    )
+    parser.add_argument(
+        '--latency', action='store_true',
+        help='collect input-to-uinput latency histograms, logged on SIGUSR1',
+    )
+    parser.add_argument(
+        '--low-latency', action='store_true',
+        help='freeze the heap and collect garbage only between keystrokes, lock the memory, use uvloop if installed',
+    )
+    parser.add_argument('--rt-priority', type=int, default=0, metavar='PRIO', help='run as SCHED_FIFO with PRIO')
+    parser.add_argument('--nice', type=int, default=0, help='add NICE to the niceness')
+    parser.add_argument(
+        '--profile-layers', action='store_true',
+        help='time every layer of the compiled pipelines, logged on SIGUSR1 and at exit',
+    )
+    parser.add_argument(
+        '--profile-collapsed', metavar='FILE',
+        help='with --profile-layers, also write collapsed stacks for flame graphs to FILE',
+    )
+    parser.add_argument(
+        '--metrics', metavar='ADDRESS',
+        help='serve Prometheus counters on a unix socket path, PORT or HOST:PORT (localhost by default)',
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format='%(levelname)s %(asctime)s %(name)s %(message)s'
+    )
+    log_queue.install()
+
+    if args.trace:
+        tracing.enable(args.trace)
+    if args.latency:
+        latency.enable()
+    if args.low_latency:
+        runtime.enable()
+        runtime.lock_memory()
+        runtime.install_loop()
+    if args.metrics:
+        metrics.enable()
+    if args.profile_layers:
+        profiling.enable(args.profile_collapsed)
+    if args.rt_priority or args.nice:
+        runtime.set_scheduling(args.rt_priority, args.nice)
+
+    try:
+        _config = load_config(args.config, _LAYERS)
+    except (ConfigError, OSError) as e:
+        parser.error(str(e))
+
+    Watcher(
+        _config,
+        record=args.record,
+        config_path=args.config,
+        watch_config=args.watch,
+        metrics_address=args.metrics,
+    ).run()
+
+    profiling.dump()
@@ -0,0 +1,50 @@
+from array import array
+from typing import Iterator
+
+from evdev import ecodes
+
+
+KEY_CNT = ecodes.KEY_CNT
+
+
+class KeyState:
+    # pressed keys as a bitmap over all key codes, plus the code each pressed key
+    # has to be released as (0 when it is released as itself)
+    __slots__ = ('_bits', '_release_codes')
+
+    def __init__(self):
+        self._bits = bytearray((KEY_CNT + 7) // 8)
+        self._release_codes = array('H', bytes(2 * KEY_CNT))
+
+    def __contains__(self, code: int) -> bool:
+        return bool(self._bits[code >> 3] >> (code & 7) & 1)
+
+    def press(self, code: int):
+        self._bits[code >> 3] |= 1 << (code & 7)
+
+    def release(self, code: int):
+        self._bits[code >> 3] &= ~(1 << (code & 7)) & 0xff
+
+    def pressed(self) -> Iterator[int]:
+        for i, byte in enumerate(self._bits):
+            while byte:
+                low = byte & -byte
+                yield i * 8 + low.bit_length() - 1
+                byte ^= low
+
+    def snapshot(self) -> bytes:
+        return bytes(self._bits)
+
+    def set_release_code(self, code: int, release_code: int):
+        self._release_codes[code] = release_code
+
+    def get_release_code(self, code: int, default: int) -> int:
+        return self._release_codes[code] or default
+
+    def pop_release_code(self, code: int, default: int) -> int:
+        release_code = self._release_codes[code]
+        if not release_code:
+            return default
+
+        self._release_codes[code] = 0
+        return release_code
@@ -0,0 +1,109 @@
+import logging
+import math
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+from evdev import InputEvent
+
+
+# outcomes an emitted event is accounted under, untagged events are passthrough
+PASSTHROUGH = 'passthrough'
+REMAPPED = 'remapped'
+TAP = 'tap'
+HOLD = 'hold'
+DELAYED = 'delayed'
+
+_logger = logging.getLogger(__name__)
+
+
+class LogHistogram:
+    # quarter-octave buckets starting at 1us, the last one collects everything above ~2 minutes
+    BUCKETS_PER_OCTAVE = 4
+    BUCKETS = BUCKETS_PER_OCTAVE * 27
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0
+
+    def add(self, seconds: float):
+        us = seconds * 1_000_000
+        i = int(math.log2(us) * self.BUCKETS_PER_OCTAVE) + 1 if us >= 1 else 0
+
+        self.counts[min(i, self.BUCKETS - 1)] += 1
+        self.total += 1
+
+    def percentile(self, q: float) -> float:
+        # upper bound of the bucket holding the q-th quantile, in seconds
+        rank = q * self.total
+        seen = 0
+
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return 2 ** (i / self.BUCKETS_PER_OCTAVE) / 1_000_000
+
+        return 0.0
+
+
+class LatencyStats:
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, str], LogHistogram] = {}
+
+        # set by the layer that decided the outcome of `_event`, the writer only takes it
+        # for that event: a tagged event absorbed further down leaves nothing behind
+        self._event: Optional[InputEvent] = None
+        self._layer = '*'
+        self._outcome = PASSTHROUGH
+
+    def tag(self, layer: str, outcome: str, event: InputEvent):
+        self._event = event
+        self._layer = layer
+        self._outcome = outcome
+
+    def take(self, event: Optional[InputEvent]) -> Tuple[str, str]:
+        key = (self._layer, self._outcome) if event is not None and event is self._event else ('*', PASSTHROUGH)
+        self._event = None
+        self._layer = '*'
+        self._outcome = PASSTHROUGH
+        return key
+
+    def observe(self, key: Tuple[str, str], latency: float):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LogHistogram()
+
+        histogram.add(latency)
+
+    def summary(self) -> List[Tuple[str, str, int, float, float, float]]:
+        return [
+            (layer, outcome, h.total, h.percentile(0.5), h.percentile(0.99), h.percentile(0.999))
+            for (layer, outcome), h in sorted(self.histograms.items())
+        ]
+
+
+stats: Optional[LatencyStats] = None
+
+
+def enable():
+    global stats
+    stats = LatencyStats()
+
+
+def tagger(label: str) -> Optional[Callable[[str, InputEvent], None]]:
+    # layers keep the result and call it with an outcome and the event, `None` when disabled
+    if stats is None:
+        return None
+
+    return partial(stats.tag, label)
+
+
+def dump():
+    if stats is None:
+        return
+
+    for layer, outcome, count, p50, p99, p999 in stats.summary():
+        _logger.info(
+            'latency %s %s: n=%d p50=%.3fms p99=%.3fms p999=%.3fms',
+            layer, outcome, count, p50 * 1000, p99 * 1000, p999 * 1000,
+        )
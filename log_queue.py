@@ -0,0 +1,54 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+from typing import Optional
+
+
+LOG_QUEUE_SIZE = 1024
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # never waits: records that don't fit in the queue are counted and dropped,
+    # the count is logged once there is room again
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+        self._reported = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if self.dropped != self._reported:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': '%d log messages dropped', 'args': (self.dropped - self._reported,),
+                }))
+                self._reported = self.dropped
+
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def install(size: int = LOG_QUEUE_SIZE):
+    # the root logger's handlers move to a writer thread, the loop only formats and enqueues
+    global handler, _listener
+
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+
+    q = queue.Queue(size)
+    handler = DroppingQueueHandler(q)
+    _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+
+    for h in handlers:
+        root.removeHandler(h)
+    root.addHandler(handler)
+
+    _listener.start()
+    atexit.register(_listener.stop)
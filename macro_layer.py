@@ -0,0 +1,89 @@
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from evdev import InputEvent, KeyEvent, ecodes
+
+import latency
+from base import AbstractLayer, ModLayer
+from clock import Clock, Timer
+
+
+# chords written per loop iteration when a macro isn't paced
+MACRO_BURST = 16
+
+
+def _chord(step) -> List[int]:
+    if isinstance(step, int):
+        return [step]
+    if isinstance(step, str):
+        return [ecodes.ecodes[k.strip()] for k in step.split('+')]
+    return list(step)
+
+
+class MacroLayer(ModLayer):
+    # a trigger key types a sequence of keys and chords. the sequence is played from the
+    # event loop, one frame per press and release, `pace` seconds apart or in bursts of
+    # MACRO_BURST chords, so the input keeps flowing while a long macro is typed
+    __slots__ = ('handled_keys', '_macros', '_pace', '_queue', '_handle')
+
+    options = {'macros': 'macros', 'pace': 'duration'}
+
+    _macros: Dict[int, List[List[int]]]
+    _pace: float
+
+    _queue: Deque[List[int]]
+    _handle: Optional[Timer]
+
+    def __init__(self, out: AbstractLayer, clock: Optional[Clock] = None, **kwargs):
+        super().__init__(out, clock, **kwargs)
+
+        self._queue = deque()
+        self._handle = None
+
+    def configure(self, macros=None, pace=0.0):
+        self._macros = {
+            ecodes.ecodes[k] if isinstance(k, str) else k: [_chord(step) for step in steps]
+            for k, steps in (macros or {}).items()
+        }
+        self._pace = pace
+
+        self.handled_keys = frozenset(self._macros)
+
+    def _write_frame(self, codes: List[int], value: int, sec: int, usec: int):
+        for code in codes:
+            self._emit(InputEvent(sec, usec, ecodes.EV_KEY, code, value), latency.DELAYED)
+        self._emit(InputEvent(sec, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    def _play(self):
+        self._handle = None
+
+        now = self.clock.now()
+        sec, usec = int(now), int(now % 1 * 1_000_000)
+
+        for _ in range(1 if self._pace else MACRO_BURST):
+            if not self._queue:
+                return
+
+            chord = self._queue.popleft()
+            self._write_frame(chord, KeyEvent.key_down, sec, usec)
+            self._write_frame(chord[::-1], KeyEvent.key_up, sec, usec)
+
+        if self._queue:
+            self._schedule()
+
+    def _schedule(self):
+        self._handle = self.clock.call_later(self._pace, self._play)
+
+    def send(self, event: InputEvent):
+        steps = self._macros.get(event.code) if event.type == ecodes.EV_KEY else None
+        if steps is None:
+            self._emit(event)
+            return
+
+        if event.value != KeyEvent.key_down:
+            return
+
+        # a macro triggered while another one plays is typed after it
+        self._queue.extend(steps)
+        if self._handle is None:
+            self._schedule()
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+import stat
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import latency
+
+
+_logger = logging.getLogger(__name__)
+
+TSample = Tuple[str, Dict[str, str], int]
+
+_HELP = {
+    'kbfn_events_read_total': 'input events read from the device',
+    'kbfn_events_coalesced_total': 'stale events dropped while catching up with the device',
+    'kbfn_events_written_total': 'events written to uinput',
+    'kbfn_uinput_write_errors_total': 'failed writes to uinput',
+    'kbfn_reconnects_total': 'devices attached again after going away',
+    'kbfn_layer_events_total': 'events emitted by a layer, by outcome',
+    'kbfn_layer_decisions_total': 'tap/hold decisions of the dual-role layers',
+    'kbfn_first_key_delay_total': 'first-key delay timers that fired',
+}
+
+
+class LayerCounters:
+    # bumped by the layer on the hot path, only read when scraped
+    __slots__ = ('events', 'taps', 'holds', 'first_key_delays')
+
+    def __init__(self):
+        self.events = dict.fromkeys(
+            (latency.PASSTHROUGH, latency.REMAPPED, latency.TAP, latency.HOLD, latency.DELAYED), 0,
+        )
+        self.taps = 0
+        self.holds = 0
+        self.first_key_delays = 0
+
+
+class Metrics:
+
+    def __init__(self):
+        # by (device, place in its stack)
+        self.layers: Dict[Tuple[str, str], LayerCounters] = {}
+        self._sources: List[Callable[[], Iterable[TSample]]] = []
+
+    def register(self, device: str, name: str) -> LayerCounters:
+        # stacks rebuilt on reloads and reconnects keep counting where the old ones stopped
+        counters = self.layers.get((device, name))
+        if counters is None:
+            counters = self.layers[device, name] = LayerCounters()
+        return counters
+
+    def add_source(self, source: Callable[[], Iterable[TSample]]):
+        # `source()` yields (name, labels, value) of counters kept elsewhere
+        self._sources.append(source)
+
+    def samples(self) -> Iterable[TSample]:
+        for source in self._sources:
+            yield from source()
+
+        for (device, name), c in self.layers.items():
+            labels = {'device': device, 'layer': name}
+
+            for outcome, count in c.events.items():
+                yield 'kbfn_layer_events_total', {**labels, 'outcome': outcome}, count
+
+            if c.taps or c.holds:
+                yield 'kbfn_layer_decisions_total', {**labels, 'decision': 'tap'}, c.taps
+                yield 'kbfn_layer_decisions_total', {**labels, 'decision': 'hold'}, c.holds
+            if c.first_key_delays:
+                yield 'kbfn_first_key_delay_total', labels, c.first_key_delays
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        by_name: Dict[str, List[str]] = {}
+
+        for name, labels, value in self.samples():
+            label_text = ','.join(
+                '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels.items()
+            )
+            by_name.setdefault(name, []).append(
+                '%s{%s} %d' % (name, label_text, value) if label_text else '%s %d' % (name, value)
+            )
+
+        lines = []
+        for name, samples in by_name.items():
+            lines.append('# HELP %s %s' % (name, _HELP.get(name, name)))
+            lines.append('# TYPE %s counter' % name)
+            lines.extend(samples)
+
+        return '\n'.join(lines) + '\n'
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # whatever the request is, the answer is the metrics page
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            pass
+
+        body = self.render().encode()
+        writer.write(
+            b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: %d\r\n\r\n' % len(body)
+        )
+        writer.write(body)
+
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def serve(self, address: str) -> asyncio.AbstractServer:
+        # a path is a unix socket, `port` or `host:port` is plain HTTP, on localhost by default
+        if '/' in address:
+            # a socket left behind by an earlier run is replaced, anything else at the path is kept
+            try:
+                if stat.S_ISSOCK(os.stat(address).st_mode):
+                    os.unlink(address)
+            except FileNotFoundError:
+                pass
+            server = await asyncio.start_unix_server(self._handle, address)
+        else:
+            host, _, port = address.rpartition(':')
+            server = await asyncio.start_server(self._handle, host or '127.0.0.1', int(port))
+
+        _logger.info('metrics on %s', address)
+        return server
+
+
+stats: Optional[Metrics] = None
+
+
+def enable():
+    global stats
+    stats = Metrics()
+
+
+def counters(device: str, name: str) -> Optional[LayerCounters]:
+    # layers keep the result and bump it, `None` when metrics are off
+    if stats is None:
+        return None
+
+    return stats.register(device, name)
@@ -0,0 +1,213 @@
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Type
+
+from evdev import InputEvent, ecodes
+
+import latency
+import profiling
+from base import AbstractLayer, EventWriter, ModLayer, input_event, layer_label
+from clock import Clock, default_clock
+from metrics import LayerCounters
+
+
+TLayerSpec = Tuple[Type[ModLayer], dict]
+
+_KEY_CNT = ecodes.KEY_CNT
+_EV_CNT = ecodes.EV_CNT
+
+
+class DispatchLayer(AbstractLayer):
+    # `table[code]` is (output code, send of the first stage that handles it),
+    # remaps are folded in and unhandled keys go straight to the writer;
+    # `types[type]` is the same for the other event types (EV_MSC, EV_REL, EV_SYN, ...);
+    # `batches[send]` is the send_batch of the stage, when it has one that can be called directly
+    __slots__ = ('table', 'types', 'batches')
+
+    def __init__(
+        self,
+        table: List[Tuple[int, callable]],
+        types: List[callable],
+        batches: Dict[callable, callable],
+    ):
+        self.table = table
+        self.types = types
+        self.batches = batches
+
+    def send(self, event: InputEvent):
+        if event.type == ecodes.EV_KEY and event.code < _KEY_CNT:
+            event.code, send = self.table[event.code]
+            send(event)
+        else:
+            self.types[event.type](event)
+
+    def send_batch(self, events: List[InputEvent]):
+        # consecutive events going to the same stage are handed over in one call
+        table = self.table
+        types = self.types
+        run = []
+        run_send = None
+
+        for event in events:
+            if event.type == ecodes.EV_KEY and event.code < _KEY_CNT:
+                event.code, send = table[event.code]
+            else:
+                send = types[event.type]
+
+            if send is not run_send:
+                if run:
+                    self._send_run(run_send, run)
+                    run = []
+                run_send = send
+
+            run.append(event)
+
+        if run:
+            self._send_run(run_send, run)
+
+    def _send_run(self, send: callable, run: List[InputEvent]):
+        send_batch = self.batches.get(send)
+        if send_batch is not None:
+            send_batch(run)
+        else:
+            for event in run:
+                send(event)
+
+
+def _tag_remapped(tag: Callable[[str, InputEvent], None], send: callable, event: InputEvent):
+    tag(latency.REMAPPED, event)
+    send(event)
+
+
+def _count_remapped(counters: LayerCounters, send: callable, event: InputEvent):
+    counters.events[latency.REMAPPED] += 1
+    send(event)
+
+
+def _compose_keymap(node: DispatchLayer, layer: ModLayer, keymap: dict) -> DispatchLayer:
+    table = node.table
+    composed = [table[keymap.get(code, code)] for code in range(_KEY_CNT)]
+
+    # folded layers only see the keys they remap
+    for code in keymap:
+        out_code, send = composed[code]
+        if layer._latency:
+            send = partial(_tag_remapped, layer._latency, send)
+        if layer._metrics:
+            send = partial(_count_remapped, layer._metrics, send)
+        composed[code] = out_code, send
+
+    return DispatchLayer(composed, node.types, node.batches)
+
+
+def _wrap_stateful(node: DispatchLayer, layer: ModLayer, label: str) -> DispatchLayer:
+    handled = layer.handled_keys
+    send = profiling.wrap(label, layer.send)
+
+    # profiled stages are timed per event
+    batches = node.batches if send != layer.send else {**node.batches, send: layer.send_batch}
+
+    if handled is None:
+        table = [(code, send) for code in range(_KEY_CNT)]
+    else:
+        table = [(code, send) if code in handled else entry for code, entry in enumerate(node.table)]
+
+    # events of the types the layer doesn't handle skip it, in order with the keys around them
+    handled_types = layer.handled_types
+    types = [send if etype in handled_types else entry for etype, entry in enumerate(node.types)]
+
+    return DispatchLayer(table, types, batches)
+
+
+def compile_pipeline(
+    layers: Iterable[TLayerSpec],
+    writer: AbstractLayer,
+    clock: Clock = default_clock,
+    device: str = '',
+) -> DispatchLayer:
+    # layers are built back to front: every stateful layer gets the compiled
+    # rest of the stack as `out`, stateless ones only contribute their keymap.
+    # a layer is named after its class and position, per `device`
+    write = profiling.wrap(layer_label(device, type(writer).__name__), writer.send)
+    batches = {} if write != writer.send else {write: writer.send_batch}
+    node = DispatchLayer([(code, write) for code in range(_KEY_CNT)], [write] * _EV_CNT, batches)
+
+    layers = list(layers)
+    for position in reversed(range(len(layers))):
+        cls, kwargs = layers[position]
+        name = '%s#%d' % (cls.__name__, position)
+
+        layer = cls(node, clock=clock, device=device, name=name, **kwargs)
+        keymap = layer.keymap()
+
+        if keymap is not None:
+            node = _compose_keymap(node, layer, keymap)
+        else:
+            node = _wrap_stateful(node, layer, layer_label(device, name))
+
+    return node
+
+
+class HandoverLayer(AbstractLayer):
+    # after a reload, keys held at the swap keep going to the old stack until released
+    # so they are released as whatever the old stack pressed them as
+    __slots__ = ('old', 'new', 'held', '_done')
+
+    def __init__(self, old: AbstractLayer, new: AbstractLayer, held: Set[int], done: Callable[[], None]):
+        self.old = old
+        self.new = new
+        self.held = held
+        self._done = done
+
+    def send(self, event: InputEvent):
+        if event.type == ecodes.EV_KEY and event.code in self.held:
+            if event.value == 0:
+                self.held.discard(event.code)
+
+            self.old.send(event)
+
+            if not self.held:
+                self._done()
+        else:
+            self.new.send(event)
+
+
+class RawPipeline:
+    # feeds struct input_event records read in bulk through a compiled stack: events that only
+    # go through stateless stages are written from the decoded tuple, only the ones a stateful
+    # layer handles become InputEvent objects
+
+    def __init__(self, dispatch: DispatchLayer, writer: EventWriter, clock: Clock = default_clock):
+        direct = writer.send
+
+        # output code for keys going straight to the writer, `None` when a layer handles them
+        self._direct_codes = [code if send == direct else None for code, send in dispatch.table]
+        self._types_direct = [send == direct for send in dispatch.types]
+
+        self._dispatch = dispatch
+        self._write = writer.write
+        self._clock = clock
+
+    def send_raw(self, data: memoryview):
+        direct_codes = self._direct_codes
+        types_direct = self._types_direct
+        table = self._dispatch.table
+        write = self._write
+        clock = self._clock
+
+        for sec, usec, etype, code, value in input_event.iter_unpack(data):
+            if clock.timers:
+                clock.advance(sec + usec / 1_000_000)
+
+            if etype == ecodes.EV_KEY and code < _KEY_CNT:
+                out_code = direct_codes[code]
+
+                if out_code is not None:
+                    write(sec, usec, etype, out_code, value)
+                else:
+                    out_code, send = table[code]
+                    send(InputEvent(sec, usec, etype, out_code, value))
+
+            elif types_direct[etype]:
+                write(sec, usec, etype, code, value)
+            else:
+                self._dispatch.types[etype](InputEvent(sec, usec, etype, code, value))
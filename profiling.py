@@ -0,0 +1,129 @@
+import logging
+from functools import partial
+from time import perf_counter_ns
+from typing import Callable, Dict, List, Optional, Tuple
+
+from evdev import InputEvent
+
+
+_logger = logging.getLogger(__name__)
+
+
+class LayerProfiler:
+    # the compiled pipeline calls the layers through `call`: a stack of the layers being
+    # run gives every layer its own (self) and inclusive (cumulative) time
+
+    def __init__(self):
+        self.names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self.calls: List[int] = []
+        self.self_ns: List[int] = []
+        self.cum_ns: List[int] = []
+
+        # calls that passed at least one event on, and calls that passed none
+        self.emitted: List[int] = []
+        self.absorbed: List[int] = []
+
+        # self time by stack of layer ids, for flame graphs
+        self.stacks: Dict[Tuple[int, ...], int] = {}
+
+        self._stack: List[int] = []
+        self._child_ns: List[int] = []
+        self._emits: List[int] = []
+
+    def register(self, label: str) -> int:
+        # stacks rebuilt for the same device add up under the ids of the layers they replace
+        layer_id = self._ids.get(label)
+        if layer_id is not None:
+            return layer_id
+
+        self.names.append(label)
+        for counts in (self.calls, self.self_ns, self.cum_ns, self.emitted, self.absorbed):
+            counts.append(0)
+
+        layer_id = self._ids[label] = len(self.names) - 1
+        return layer_id
+
+    def wrap(self, label: str, send: Callable[[InputEvent], None]) -> Callable[[InputEvent], None]:
+        return partial(self.call, self.register(label), send)
+
+    def call(self, layer_id: int, send: Callable[[InputEvent], None], event: InputEvent):
+        stack = self._stack
+        if stack:
+            self._emits[-1] += 1
+
+        stack.append(layer_id)
+        self._child_ns.append(0)
+        self._emits.append(0)
+
+        start = perf_counter_ns()
+        try:
+            send(event)
+        finally:
+            elapsed = perf_counter_ns() - start
+            own = elapsed - self._child_ns.pop()
+
+            path = tuple(stack)
+            stack.pop()
+
+            self.calls[layer_id] += 1
+            self.self_ns[layer_id] += own
+            self.cum_ns[layer_id] += elapsed
+
+            if self._emits.pop():
+                self.emitted[layer_id] += 1
+            else:
+                self.absorbed[layer_id] += 1
+
+            if self._child_ns:
+                self._child_ns[-1] += elapsed
+
+            self.stacks[path] = self.stacks.get(path, 0) + own
+
+    def summary(self):
+        rows = [
+            (self.names[i], self.calls[i], self.self_ns[i], self.cum_ns[i], self.emitted[i], self.absorbed[i])
+            for i in range(len(self.names)) if self.calls[i]
+        ]
+        return sorted(rows, key=lambda row: -row[2])
+
+    def write_collapsed(self, path: str):
+        # one `layer;layer;layer self_ns` line per stack, as flamegraph.pl and speedscope read it
+        with open(path, 'w') as f:
+            for stack, ns in sorted(self.stacks.items()):
+                f.write('%s %d\n' % (';'.join(self.names[i] for i in stack), ns))
+
+
+profiler: Optional[LayerProfiler] = None
+collapsed_path: Optional[str] = None
+
+
+def enable(collapsed: Optional[str] = None):
+    global profiler, collapsed_path
+    profiler = LayerProfiler()
+    collapsed_path = collapsed
+
+
+def wrap(label: str, send: Callable[[InputEvent], None]) -> Callable[[InputEvent], None]:
+    # the send the compiled pipeline calls, profiled when enabled
+    if profiler is None:
+        return send
+
+    return profiler.wrap(label, send)
+
+
+def dump():
+    if profiler is None:
+        return
+
+    for name, calls, self_ns, cum_ns, emitted, absorbed in profiler.summary():
+        _logger.info(
+            'profile %s: calls=%d self=%.3fms cum=%.3fms self/call=%dns emitted=%d absorbed=%d',
+            name, calls, self_ns / 1e6, cum_ns / 1e6, self_ns // calls, emitted, absorbed,
+        )
+
+    if collapsed_path:
+        try:
+            profiler.write_collapsed(collapsed_path)
+        except OSError as e:
+            _logger.error('can not write %s: %s', collapsed_path, e)
@@ -1,25 +1,35 @@
-import logging
-
-from typing import Dict, Union
+from typing import Dict, List, Union
 from evdev import InputEvent, ecodes
 
 from base import ModLayer
 from helpers import convert_keycode_map
 
 
-logger = logging.getLogger(__name__)
+class RemapLayer(ModLayer):
+    __slots__ = ('_codes',)
 
+    options = {'codes': 'keymap'}
 
-class RemapLayer(ModLayer):
-    _codes: Dict = None
+    _codes: Dict
 
     def configure(self, codes: Dict[Union[int, str], Union[int, str]] = None):
         self._codes = convert_keycode_map(codes or {})
 
+    def keymap(self):
+        return self._codes
+
     def send(self, event: InputEvent):
         if event.type == ecodes.EV_KEY:
             if event.code in self._codes:
                 event.code = self._codes[event.code]
-                logger.debug('remap %s', event.code)
 
         self.out.send(event)
+
+    def send_batch(self, events: List[InputEvent]):
+        codes = self._codes
+
+        for event in events:
+            if event.type == ecodes.EV_KEY and event.code in codes:
+                event.code = codes[event.code]
+
+        self.out.send_batch(events)
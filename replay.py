@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import struct
+import time
+from typing import BinaryIO, Iterable, Iterator, List, Optional
+
+from evdev import InputEvent, ecodes
+
+from base import AbstractLayer, input_event
+from clock import Clock, VirtualClock
+
+
+# file header followed by fixed size little-endian records: sec, usec, type, code, value
+MAGIC = b'KBFNREC1'
+_record = struct.Struct('<qiHHi')
+
+
+class Recorder:
+
+    def __init__(self, path: str):
+        self._file: BinaryIO = open(path, 'ab')
+
+        # reconnects append to the same recording
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def write(self, event: InputEvent):
+        self._file.write(_record.pack(event.sec, event.usec, event.type, event.code, event.value))
+
+    def write_raw(self, data: memoryview):
+        for record in input_event.iter_unpack(data):
+            self._file.write(_record.pack(*record))
+
+    def close(self):
+        self._file.close()
+
+
+def read_events(path: str) -> Iterator[InputEvent]:
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if not data.startswith(MAGIC):
+        raise ValueError('%s is not a kbfn recording' % path)
+
+    for record in _record.iter_unpack(memoryview(data)[len(MAGIC):]):
+        yield InputEvent(*record)
+
+
+class EventSink(AbstractLayer):
+    # stands in for EventWriter when there is no uinput device
+    __slots__ = ('count', 'events', '_keep')
+
+    def __init__(self, keep: bool = False):
+        self.count = 0
+        self.events: List[InputEvent] = []
+        self._keep = keep
+
+    def send(self, event: InputEvent):
+        self.count += 1
+        if self._keep:
+            self.events.append(event)
+
+
+async def replay(
+    events: Iterable[InputEvent],
+    pipeline: AbstractLayer,
+    realtime: bool = False,
+    clock: Optional[Clock] = None,
+):
+    # with a VirtualClock (the pipeline has to be compiled with it) the recorded timestamps drive
+    # the layers' timers, frames are fed back to back and the output is the same every time
+    if isinstance(clock, VirtualClock):
+        for event in events:
+            clock.advance(event.timestamp())
+            pipeline.send(event)
+
+        clock.run_pending()
+        return
+
+    # otherwise events are restamped to the current time so the timers behave as if typed now;
+    # `realtime` keeps the recorded gaps
+    offset = None
+
+    for event in events:
+        if realtime:
+            if offset is None:
+                offset = time.time() - event.timestamp()
+
+            delay = event.timestamp() + offset - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        now = time.time()
+        event.sec, event.usec = int(now), int(now % 1 * 1_000_000)
+
+        pipeline.send(event)
+
+        # let due timers run between frames
+        if event.type == ecodes.EV_SYN:
+            await asyncio.sleep(0)
+
+
+if __name__ == '__main__':
+    from config import load_config
+    from kbfn import _LAYERS, device_configs, layer_specs
+    from pipeline import compile_pipeline
+
+    parser = argparse.ArgumentParser(prog='replay', description='feed a recording through a config\'s layers')
+    parser.add_argument('config', help='path to config.json')
+    parser.add_argument('recording', help='file written by `kbfn --record`')
+    parser.add_argument('--realtime', action='store_true', help='keep the recorded timing')
+    args = parser.parse_args()
+
+    _config = device_configs(load_config(args.config, _LAYERS))[0]
+
+    sink = EventSink(keep=True)
+    _clock = Clock() if args.realtime else VirtualClock()
+    _pipeline = compile_pipeline(layer_specs(_config), sink, _clock)
+    asyncio.run(replay(read_events(args.recording), _pipeline, args.realtime, _clock))
+
+    for _event in sink.events:
+        if _event.type != ecodes.EV_SYN:
+            _names = ecodes.bytype.get(_event.type, {})
+            print('%s\t%s\t%d' % (ecodes.EV[_event.type], _names.get(_event.code, _event.code), _event.value))
@@ -0,0 +1,102 @@
+import asyncio
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+from typing import Optional
+
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+# how often the deferred collector looks for a quiet moment
+IDLE_INTERVAL = 1.0
+
+# young objects allowed to pile up before they are collected even while typing
+FORCE_COLLECT = 50_000
+
+_logger = logging.getLogger(__name__)
+
+# set by the readers on every frame, cleared by the collector
+active = False
+
+
+class IdleCollector:
+    # the cyclic gc runs between keystrokes: automatic collection is off and a timer
+    # does a full collection once an interval passed without input
+
+    def __init__(self, interval: float = IDLE_INTERVAL):
+        self.interval = interval
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+        # freeze what survives the next idle collection
+        self.freeze_pending = False
+
+    def start(self):
+        gc.disable()
+        self._handle = asyncio.get_event_loop().call_later(self.interval, self._tick)
+
+    def stop(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        gc.enable()
+
+    def _tick(self):
+        global active
+
+        young = gc.get_count()[0]
+        if not active and (young or self.freeze_pending):
+            gc.collect()
+            if self.freeze_pending:
+                gc.freeze()
+                self.freeze_pending = False
+        elif young > FORCE_COLLECT:
+            gc.collect(1)
+
+        active = False
+        self._handle = asyncio.get_event_loop().call_later(self.interval, self._tick)
+
+
+collector: Optional[IdleCollector] = None
+
+
+def enable():
+    global collector
+    collector = IdleCollector()
+
+
+def freeze():
+    # called once the layers are built: what exists then is never scanned again.
+    # the collection before freezing waits for a quiet moment, other devices may be typing
+    if collector is None:
+        return
+
+    collector.freeze_pending = True
+
+
+def lock_memory():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        _logger.warning('mlockall failed: %s', os.strerror(ctypes.get_errno()))
+
+
+def set_scheduling(rt_priority: int = 0, nice: int = 0):
+    try:
+        if rt_priority:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(rt_priority))
+        if nice:
+            os.nice(nice)
+    except OSError as e:
+        _logger.warning('can not change the scheduling: %s', e)
+
+
+def install_loop():
+    try:
+        import uvloop
+    except ImportError:
+        _logger.debug('uvloop is not installed, using the default event loop')
+        return
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
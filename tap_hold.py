@@ -0,0 +1,219 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+from evdev import InputEvent, KeyEvent, ecodes
+
+import latency
+from adaptive import AdaptiveDelay
+from base import AbstractLayer, ModLayer
+from clock import Clock, Timer
+from helpers import convert_keycode_map
+from keystate import KeyState
+
+
+MOD_THRESHOLD = 0.5
+FIRST_KEY_DELAY = 0.05
+
+# a modifier code or the keymap of a fn layer
+TAction = Union[int, Dict[int, int]]
+
+
+class TapHoldLayer(ModLayer):
+    # any number of keys that type themselves when tapped and act as a modifier
+    # (`mods`) or switch to a fn layer (`fn_layers`) when held, in one state machine:
+    # while a key is undecided the keys pressed after it wait in one buffer under one timer.
+    #
+    # the key is held when it's held for `mod_threshold`, when the first key pressed after it
+    # is held for `first_key_delay` or when another key event follows that first press
+    # (releasing the first key included); it's tapped when it's released before any of that.
+    # with `adaptive` the first-key delay follows the user's own rolls, see AdaptiveDelay
+    __slots__ = (
+        '_actions', '_active', '_layer', 'keys',
+        '_undecided', '_deadline', '_pending', '_timer',
+        '_mod_threshold', '_first_key_delay', '_adaptive', '_missed',
+    )
+
+    options = {
+        'mods': 'keymap', 'fn_layers': 'keymaps',
+        'mod_threshold': 'timeout', 'first_key_delay': 'timeout', 'adaptive': 'bool',
+    }
+
+    _actions: Dict[int, TAction]
+
+    # tap-hold keys decided as held, and the fn layer switched on last
+    _active: Dict[int, TAction]
+    _layer: Optional[Dict[int, int]]
+
+    # keys pressed downstream and the codes they are released as
+    keys: KeyState
+
+    _undecided: int
+    _deadline: float
+    _pending: List[InputEvent]
+    _timer: Optional[Timer]
+
+    _mod_threshold: float
+    _first_key_delay: float
+    _adaptive: Optional[AdaptiveDelay]
+
+    # (tap-hold key, first key, its press time) of the last hold decided by the first-key timer
+    _missed: Optional[Tuple[int, int, float]]
+
+    def __init__(self, out: AbstractLayer, clock: Optional[Clock] = None, **kwargs):
+        super().__init__(out, clock, **kwargs)
+
+        self._active = {}
+        self._layer = None
+
+        self.keys = KeyState()
+
+        self._undecided = 0
+        self._deadline = 0.0
+        self._pending = []
+        self._timer = None
+        self._missed = None
+
+    def configure(self, mods=None, fn_layers=None, mod_threshold=MOD_THRESHOLD,
+                  first_key_delay=FIRST_KEY_DELAY, adaptive=False):
+        fn_layers = {k: convert_keycode_map(v) for k, v in convert_keycode_map(fn_layers or {}).items()}
+        self._actions = {**fn_layers, **convert_keycode_map(mods or {})}
+
+        self._mod_threshold = mod_threshold
+        self._first_key_delay = first_key_delay
+        self._adaptive = AdaptiveDelay(first_key_delay) if adaptive else None
+
+    def _write_key(self, code: int, value: int, sec: int, usec: int, outcome: str):
+        self._emit(InputEvent(sec, usec, ecodes.EV_KEY, code, value), outcome)
+
+    def _schedule(self, deadline: float):
+        if self._timer:
+            self._timer.cancel()
+
+        self._deadline = deadline
+        self._timer = self.clock.call_at(deadline, self._expired)
+
+    def _expired(self):
+        self._timer = None
+
+        if self._undecided:
+            if self._metrics and self._pending:
+                self._metrics.first_key_delays += 1
+
+            # whether it was a roll the delay was too short for shows when the key is released
+            if self._adaptive and self._pending and self._pending[0].value == KeyEvent.key_down:
+                first = self._pending[0]
+                self._missed = (self._undecided, first.code, first.timestamp())
+
+            # stamped when it came due: fired from a late read, the clock is already past it
+            deadline = self._deadline
+            self._decide(True, int(deadline), int(deadline % 1 * 1_000_000), latency.DELAYED)
+
+    def _decide(self, hold: bool, sec: int, usec: int, outcome: str):
+        code, self._undecided = self._undecided, 0
+        pending, self._pending = self._pending, []
+
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        if self._metrics:
+            if hold:
+                self._metrics.holds += 1
+            else:
+                self._metrics.taps += 1
+
+        if hold:
+            action = self._active[code] = self._actions[code]
+            if isinstance(action, int):
+                self._write_key(action, KeyEvent.key_down, sec, usec, latency.HOLD)
+            else:
+                self._layer = action
+        else:
+            self._write_key(code, KeyEvent.key_down, sec, usec, latency.TAP)
+            self._write_key(code, KeyEvent.key_up, sec, usec, latency.TAP)
+
+        # the buffered keys may start the next tap-hold key
+        for event in pending:
+            self._send_key(event, outcome)
+
+    def _buffer(self, event: InputEvent):
+        code = event.code
+
+        if code == self._undecided:
+            if event.value == KeyEvent.key_up:
+                if self._adaptive and len(self._pending) == 1 and self._pending[0].value == KeyEvent.key_down:
+                    self._first_key_delay = self._adaptive.observe(event.timestamp() - self._pending[0].timestamp())
+                self._decide(False, event.sec, event.usec, latency.TAP)
+            return
+
+        # keys pressed before the tap-hold key repeat and are released as usual,
+        # they don't decide anything
+        if code in self.keys:
+            self._process(event)
+            return
+
+        self._pending.append(event)
+
+        if len(self._pending) == 1:
+            self._schedule(min(self._deadline, event.timestamp() + self._first_key_delay))
+        else:
+            self._decide(True, event.sec, event.usec, latency.HOLD)
+
+    def _release_hold(self, code: int, event: InputEvent):
+        action = self._active.pop(code)
+
+        if self._missed and self._missed[0] == code:
+            _, first, pressed = self._missed
+            self._missed = None
+            # released before the key that made it a hold: a roll after all
+            if first in self.keys:
+                self._first_key_delay = self._adaptive.observe(event.timestamp() - pressed)
+
+        if isinstance(action, int):
+            self._write_key(action, KeyEvent.key_up, event.sec, event.usec, latency.HOLD)
+        elif action is self._layer:
+            self._layer = next((a for a in reversed(self._active.values()) if not isinstance(a, int)), None)
+
+    def _process(self, event: InputEvent, outcome: str = None):
+        code = event.code
+        value = event.value
+
+        if code in self._active:
+            if value == KeyEvent.key_up:
+                self._release_hold(code, event)
+            return
+
+        if value == KeyEvent.key_down:
+            # keys of the active fn layer are remapped, tap-hold keys included
+            if self._layer is not None and code in self._layer:
+                event.code = self._layer[code]
+                self.keys.set_release_code(code, event.code)
+                outcome = latency.HOLD
+            elif code in self._actions:
+                self._undecided = code
+                self._schedule(event.timestamp() + self._mod_threshold)
+                return
+
+            self.keys.press(code)
+        elif code not in self.keys:
+            # repeats and releases of tap-hold keys were dealt with when they were decided
+            if code in self._actions:
+                return
+        elif value == KeyEvent.key_up:
+            self.keys.release(code)
+            event.code = self.keys.pop_release_code(code, code)
+        else:
+            event.code = self.keys.get_release_code(code, code)
+
+        self._emit(event, outcome)
+
+    def _send_key(self, event: InputEvent, outcome: str = None):
+        if self._undecided:
+            self._buffer(event)
+        else:
+            self._process(event, outcome)
+
+    def send(self, event: InputEvent):
+        if event.type == ecodes.EV_KEY:
+            self._send_key(event)
+        else:
+            self._emit(event)
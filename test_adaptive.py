@@ -0,0 +1,85 @@
+import asyncio
+
+from evdev import InputEvent, ecodes
+
+from adaptive import AdaptiveDelay
+from clock import VirtualClock
+from pipeline import compile_pipeline
+from replay import EventSink, replay
+from tap_hold import TapHoldLayer
+
+
+A, X, CTRL = ecodes.KEY_A, ecodes.KEY_X, ecodes.KEY_LEFTCTRL
+
+
+def test_delay_waits_for_enough_samples():
+    adaptive = AdaptiveDelay(0.1)
+    for _ in range(AdaptiveDelay.MIN_SAMPLES - 1):
+        assert adaptive.observe(0.02) == 0.1
+
+    assert adaptive.observe(0.02) == 0.02 * AdaptiveDelay.MARGIN
+
+
+def test_delay_stays_between_floor_and_ceiling():
+    adaptive = AdaptiveDelay(0.1)
+    for _ in range(AdaptiveDelay.MIN_SAMPLES):
+        adaptive.observe(0.001)
+    assert adaptive.delay == AdaptiveDelay.FLOOR
+
+    for _ in range(AdaptiveDelay.WINDOW):
+        adaptive.observe(0.5)
+    assert adaptive.delay == 0.1
+
+
+def test_delay_grows_back_from_longer_overlaps():
+    adaptive = AdaptiveDelay(0.1)
+    for _ in range(AdaptiveDelay.MIN_SAMPLES):
+        adaptive.observe(0.01)
+
+    adaptive.observe(0.04)
+    assert adaptive.observe(0.04) == 0.04 * AdaptiveDelay.MARGIN
+
+
+def _rolls(overlaps_ms):
+    # A rolled into X: X is pressed 5ms after A, A is released `overlap` after X
+    script = []
+    for i, overlap in enumerate(overlaps_ms):
+        t = i * 200
+        script += [(t, A, 1), (t + 5, X, 1), (t + 5 + overlap, A, 0), (t + 10 + overlap, X, 0)]
+    return script
+
+
+def _run(script):
+    clock = VirtualClock(100.0)
+    sink = EventSink(keep=True)
+    layer = (TapHoldLayer, {'mods': {'KEY_A': 'KEY_LEFTCTRL'}, 'first_key_delay': 0.1, 'adaptive': True})
+    pipeline = compile_pipeline([layer], sink, clock)
+
+    events = []
+    for ms, code, value in script:
+        sec, usec = 100 + ms // 1000, ms % 1000 * 1000
+        events.append(InputEvent(sec, usec, ecodes.EV_KEY, code, value))
+        events.append(InputEvent(sec, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    asyncio.run(replay(events, pipeline, clock=clock))
+    return [(e.code, e.value) for e in sink.events if e.type == ecodes.EV_KEY]
+
+
+_TAP = [(A, 1), (A, 0), (X, 1), (X, 0)]
+_HOLD = [(CTRL, 1), (X, 1), (CTRL, 0), (X, 0)]
+
+
+def test_layer_learns_short_rolls():
+    fast = [5] * AdaptiveDelay.MIN_SAMPLES
+
+    # a 30ms roll is a tap under the configured delay, a hold once the delay follows 5ms rolls
+    assert _run(_rolls([30])) == _TAP
+    assert _run(_rolls(fast + [30]))[-4:] == _HOLD
+
+
+def test_layer_grows_back_from_missed_rolls():
+    fast = [5] * AdaptiveDelay.MIN_SAMPLES
+
+    # the missed rolls come out as holds, then the delay covers them again
+    output = _run(_rolls(fast + [30, 30, 30]))
+    assert output[-12:] == _HOLD + _HOLD + _TAP
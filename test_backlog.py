@@ -0,0 +1,30 @@
+from evdev import InputEvent, ecodes
+
+import backlog
+
+
+def _frame(*events):
+    return [InputEvent(1, 0, etype, code, value) for etype, code, value in events] + [
+        InputEvent(1, 0, ecodes.EV_SYN, ecodes.SYN_REPORT, 0)
+    ]
+
+
+def _values(events):
+    return [(e.type, e.code, e.value) for e in events if e.type != ecodes.EV_SYN]
+
+
+def test_relative_motion_adds_up():
+    events = _frame((ecodes.EV_REL, ecodes.REL_X, 3)) + _frame((ecodes.EV_REL, ecodes.REL_X, 4))
+    assert _values(backlog.coalesce(events)) == [(ecodes.EV_REL, ecodes.REL_X, 7)]
+
+
+def test_multitouch_frames_are_kept():
+    events = (
+        _frame(
+            (ecodes.EV_ABS, ecodes.ABS_MT_SLOT, 0), (ecodes.EV_ABS, ecodes.ABS_MT_POSITION_X, 10),
+            (ecodes.EV_ABS, ecodes.ABS_MT_SLOT, 1), (ecodes.EV_ABS, ecodes.ABS_MT_POSITION_X, 500),
+        )
+        + _frame((ecodes.EV_ABS, ecodes.ABS_MT_SLOT, 0), (ecodes.EV_ABS, ecodes.ABS_MT_TRACKING_ID, -1))
+        + _frame((ecodes.EV_ABS, ecodes.ABS_MT_SLOT, 1), (ecodes.EV_ABS, ecodes.ABS_MT_POSITION_X, 510))
+    )
+    assert _values(backlog.coalesce(events)) == _values(events)
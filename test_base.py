@@ -0,0 +1,40 @@
+import asyncio
+import os
+
+from evdev import InputEvent, ecodes
+
+from base import EventWriter, input_event
+
+
+class _Output:
+    def __init__(self):
+        self.read_fd, self.fd = os.pipe()
+
+    def records(self):
+        return [record[2:] for record in input_event.iter_unpack(os.read(self.read_fd, 1 << 16))]
+
+
+def test_batched_writer_keeps_mt_reports_in_the_frame():
+    async def main():
+        ui = _Output()
+        writer = EventWriter(ui, batch=True)
+
+        # multitouch protocol A: contacts separated by SYN_MT_REPORT
+        writer.send_batch([
+            InputEvent(1, 0, ecodes.EV_ABS, ecodes.ABS_MT_POSITION_X, 10),
+            InputEvent(1, 0, ecodes.EV_SYN, ecodes.SYN_MT_REPORT, 0),
+            InputEvent(1, 0, ecodes.EV_ABS, ecodes.ABS_MT_POSITION_X, 500),
+            InputEvent(1, 0, ecodes.EV_SYN, ecodes.SYN_MT_REPORT, 0),
+            InputEvent(1, 0, ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+        ])
+
+        assert writer.written == 2
+        return ui.records()
+
+    assert asyncio.run(main()) == [
+        (ecodes.EV_ABS, ecodes.ABS_MT_POSITION_X, 10),
+        (ecodes.EV_SYN, ecodes.SYN_MT_REPORT, 0),
+        (ecodes.EV_ABS, ecodes.ABS_MT_POSITION_X, 500),
+        (ecodes.EV_SYN, ecodes.SYN_MT_REPORT, 0),
+        (ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+    ]
@@ -0,0 +1,49 @@
+import asyncio
+
+from evdev import InputEvent, ecodes
+
+from clock import VirtualClock
+from combo_layer import ComboLayer
+from pipeline import compile_pipeline
+from replay import EventSink, replay
+
+
+J, K, L, A, ESC, TAB = ecodes.KEY_J, ecodes.KEY_K, ecodes.KEY_L, ecodes.KEY_A, ecodes.KEY_ESC, ecodes.KEY_TAB
+
+_LAYER = (ComboLayer, {'combos': {'KEY_J+KEY_K': 'KEY_ESC', 'KEY_J+KEY_K+KEY_L': 'KEY_TAB'}})
+
+
+def _run(script):
+    # `script` is (ms, code, value) frames
+    clock = VirtualClock(100.0)
+    sink = EventSink(keep=True)
+    pipeline = compile_pipeline([_LAYER], sink, clock)
+
+    events = []
+    for ms, code, value in script:
+        events.append(InputEvent(100, ms * 1000, ecodes.EV_KEY, code, value))
+        events.append(InputEvent(100, ms * 1000, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    asyncio.run(replay(events, pipeline, clock=clock))
+    return [(e.code, e.value) for e in sink.events if e.type == ecodes.EV_KEY]
+
+
+def test_hit_in_any_order():
+    for first, second in ((J, K), (K, J)):
+        assert _run([(0, first, 1), (10, second, 1), (100, first, 0), (110, second, 0)]) == [(ESC, 1), (ESC, 0)]
+
+
+def test_larger_combo_wins_inside_the_window():
+    assert _run([(0, J, 1), (10, K, 1), (20, L, 1), (100, J, 0), (110, K, 0), (120, L, 0)]) == [(TAB, 1), (TAB, 0)]
+
+
+def test_partial_combo_goes_out_when_the_window_ends():
+    assert _run([(0, J, 1), (100, J, 0)]) == [(J, 1), (J, 0)]
+
+
+def test_partial_combo_then_slow_key():
+    assert _run([(0, J, 1), (80, K, 1), (100, J, 0), (110, K, 0)]) == [(J, 1), (K, 1), (J, 0), (K, 0)]
+
+
+def test_miss_with_another_key():
+    assert _run([(0, J, 1), (10, A, 1), (20, J, 0), (30, A, 0)]) == [(J, 1), (A, 1), (J, 0), (A, 0)]
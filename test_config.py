@@ -0,0 +1,28 @@
+import pytest
+
+import kbfn
+from config import ConfigError, compile_config
+
+
+def _layer(**layer):
+    return compile_config({'device': 'kb', 'layers': [layer]}, kbfn._LAYERS)['layers'][0]
+
+
+@pytest.mark.parametrize('layer, option', [
+    ({'type': 'DualRole', 'codes': {}}, 'first_key_delay'),
+    ({'type': 'TapHold', 'mods': {}}, 'mod_threshold'),
+    ({'type': 'Combo', 'combos': {}}, 'window'),
+])
+def test_timeouts_must_be_positive(layer, option):
+    assert _layer(**layer, **{option: 0.2})[option] == 0.2
+
+    for value in (0, -0.05, float('nan')):
+        with pytest.raises(ConfigError, match=option):
+            _layer(**layer, **{option: value})
+
+
+def test_pace_may_be_zero():
+    assert _layer(type='Macro', macros={}, pace=0)['pace'] == 0
+
+    with pytest.raises(ConfigError, match='pace'):
+        _layer(type='Macro', macros={}, pace=-1)
@@ -0,0 +1,177 @@
+import asyncio
+import contextlib
+import os
+import time
+
+from evdev import InputEvent, ecodes
+from evdev.eventio_async import EventIO
+
+import kbfn
+from base import input_event
+from clock import Clock
+from config import compile_config
+
+
+class PipeDevice(EventIO):
+    # an input device fed through a pipe, read by evdev's own async reader
+
+    def __init__(self):
+        self.fd, self.feed_fd = os.pipe()
+        os.set_blocking(self.fd, False)
+        self.path = '/dev/input/test'
+        self.name = 'test'
+        self.held = set()
+
+    def grab_context(self):
+        return contextlib.nullcontext()
+
+    def active_keys(self):
+        return sorted(self.held)
+
+    def write(self, timestamp: float, *keys):
+        # one frame with a (code, value) per key
+        sec, usec = int(timestamp), int(timestamp % 1 * 1_000_000)
+        for code, value in keys:
+            if value:
+                self.held.add(code)
+            else:
+                self.held.discard(code)
+        records = [input_event.pack(sec, usec, ecodes.EV_KEY, code, value) for code, value in keys]
+        os.write(self.feed_fd, b''.join(records) + input_event.pack(sec, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    def close(self):
+        super().close()
+        os.close(self.fd)
+        os.close(self.feed_fd)
+
+
+class PipeOutput:
+    # stands in for the uinput device, both writer modes write input_event records to `fd`
+
+    def __init__(self):
+        self.read_fd, self.fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+
+    def write_event(self, event: InputEvent):
+        os.write(self.fd, input_event.pack(event.sec, event.usec, event.type, event.code, event.value))
+
+    def syn(self):
+        os.write(self.fd, input_event.pack(0, 0, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    def keys(self):
+        try:
+            data = os.read(self.read_fd, 1 << 16)
+        except BlockingIOError:
+            return []
+
+        return [
+            (ecodes.KEY[code], value)
+            for _sec, _usec, etype, code, value in input_event.iter_unpack(data) if etype == ecodes.EV_KEY
+        ]
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.fd)
+
+
+def _config(layers=None, **settings):
+    return compile_config({
+        'device': 'test',
+        'layers': layers or [{'type': 'DualRole', 'codes': {'KEY_J': 'KEY_LEFT'}}],
+        **settings,
+    }, kbfn._LAYERS)
+
+
+async def _run(config: dict, script) -> list:
+    # `script(dev, k)` types on the device while KBFN.run reads it
+    dev = PipeDevice()
+    out = PipeOutput()
+
+    k = kbfn.KBFN(dev, config)
+    k.clock = Clock()
+
+    task = asyncio.ensure_future(k.run(out))
+    try:
+        await script(dev, k)
+        await asyncio.sleep(0.1)
+        assert not task.done(), task.exception()
+    finally:
+        k.close()
+        await asyncio.wait_for(task, 1)
+        dev.close()
+
+    keys = out.keys()
+    out.close()
+    return keys
+
+
+def _tap_roll(blocked: bool):
+    async def script(dev: PipeDevice, _k: kbfn.KBFN):
+        t = time.time()
+        dev.write(t, (ecodes.KEY_SPACE, 1))
+        await asyncio.sleep(0.01)
+        dev.write(t + 0.01, (ecodes.KEY_J, 1))
+        await asyncio.sleep(0.005)
+
+        # with `blocked` the releases queue up behind a busy loop, past the first-key delay
+        for delay, code, when in ((0.015, ecodes.KEY_SPACE, 0.03), (0.01, ecodes.KEY_J, 0.04)):
+            if blocked:
+                time.sleep(delay)
+            else:
+                await asyncio.sleep(delay)
+            dev.write(t + when, (code, 0))
+
+        if blocked:
+            time.sleep(0.12)
+
+    return script
+
+
+def test_run_reads_an_event_io_device():
+    for settings in ({}, {'batch_output': True}, {'raw_input': True}):
+        keys = asyncio.run(_run(_config(**settings), _tap_roll(blocked=False)))
+        assert keys == [('KEY_SPACE', 1), ('KEY_SPACE', 0), ('KEY_J', 1), ('KEY_J', 0)], settings
+
+
+def test_queued_events_come_before_timers_due_after_them():
+    for settings in ({}, {'raw_input': True}):
+        keys = asyncio.run(_run(_config(**settings), _tap_roll(blocked=True)))
+        assert keys == [('KEY_SPACE', 1), ('KEY_SPACE', 0), ('KEY_J', 1), ('KEY_J', 0)], settings
+
+
+def test_reload_during_a_handover_keeps_the_newest_stack():
+    def remap(to):
+        return _config([{'type': 'Remap', 'codes': {'KEY_A': to}}])
+
+    async def script(dev: PipeDevice, k: kbfn.KBFN):
+        async def keys(*keys):
+            dev.write(time.time(), *keys)
+            await asyncio.sleep(0.01)
+
+        # every reload is swapped in at the next frame, the keys held then are handed over
+        await keys((ecodes.KEY_X, 1))
+        k.reload(remap('KEY_C'))
+        await keys((ecodes.KEY_Y, 1))
+        k.reload(remap('KEY_D'))
+        await keys((ecodes.KEY_Z, 1))
+
+        for code in (ecodes.KEY_X, ecodes.KEY_Y, ecodes.KEY_Z):
+            await keys((code, 0))
+        await keys((ecodes.KEY_A, 1))
+        await keys((ecodes.KEY_A, 0))
+
+    keys = asyncio.run(_run(remap('KEY_B'), script))
+    assert keys[-2:] == [('KEY_D', 1), ('KEY_D', 0)]
+
+
+def test_empty_read_is_ignored():
+    async def script(dev: PipeDevice, k: kbfn.KBFN):
+        await asyncio.sleep(0.01)
+        k._dispatch([])
+
+        dev.write(time.time(), (ecodes.KEY_A, 1))
+        await asyncio.sleep(0.01)
+        dev.write(time.time(), (ecodes.KEY_A, 0))
+
+    keys = asyncio.run(_run(_config(), script))
+    assert keys == [('KEY_A', 1), ('KEY_A', 0)]
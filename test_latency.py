@@ -0,0 +1,62 @@
+import asyncio
+
+from evdev import InputEvent, ecodes
+
+import latency
+import profiling
+import tracing
+from base import EventWriter
+from clock import VirtualClock
+from combo_layer import ComboLayer
+from pipeline import compile_pipeline
+from remap_layer import RemapLayer
+from replay import EventSink, replay
+
+
+class _Output:
+    def write_event(self, event: InputEvent):
+        pass
+
+    def syn(self):
+        pass
+
+
+def test_tags_stay_with_their_event():
+    latency.enable()
+    try:
+        clock = VirtualClock(100.0)
+        writer = EventWriter(_Output())
+        pipeline = compile_pipeline([
+            (RemapLayer, {'codes': {ecodes.KEY_A: ecodes.KEY_J}}),
+            (ComboLayer, {'combos': {'KEY_J+KEY_K': 'KEY_ESC'}}),
+        ], writer, clock)
+
+        # the remapped J is held back by the combo layer, the next frame's MSC isn't remapped
+        events = [
+            InputEvent(100, 0, ecodes.EV_KEY, ecodes.KEY_A, 1),
+            InputEvent(100, 0, ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+            InputEvent(100, 1000, ecodes.EV_MSC, ecodes.MSC_SCAN, 30),
+            InputEvent(100, 1000, ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+        ]
+        asyncio.run(replay(events, pipeline, clock=clock))
+
+        counts = {key: h.total for key, h in latency.stats.histograms.items()}
+        assert counts == {('*', latency.PASSTHROUGH): 1, ('ComboLayer#1', latency.DELAYED): 1}
+    finally:
+        latency.stats = None
+
+
+def test_rebuilt_stacks_reuse_their_names():
+    latency.enable()
+    tracing.enable(16)
+    profiling.enable()
+    try:
+        for _ in range(3):
+            compile_pipeline([(ComboLayer, {'combos': {'KEY_J+KEY_K': 'KEY_ESC'}})], EventSink(), device='kb')
+
+        assert tracing.ring._layers == ['kb:ComboLayer#0']
+        assert profiling.profiler.names == ['kb:EventSink', 'kb:ComboLayer#0']
+    finally:
+        latency.stats = None
+        tracing.ring = None
+        profiling.profiler = None
@@ -0,0 +1,80 @@
+import asyncio
+
+from evdev import InputEvent, ecodes
+
+from clock import VirtualClock
+from macro_layer import MACRO_BURST, MacroLayer
+from pipeline import compile_pipeline
+from replay import EventSink, replay
+
+
+F1, F2, H, I, A, SHIFT, ONE = (
+    ecodes.KEY_F1, ecodes.KEY_F2, ecodes.KEY_H, ecodes.KEY_I, ecodes.KEY_A, ecodes.KEY_LEFTSHIFT, ecodes.KEY_1,
+)
+
+_MACROS = {'KEY_F1': ['KEY_H', 'KEY_I', 'KEY_LEFTSHIFT+KEY_1'], 'KEY_F2': ['KEY_A']}
+
+
+def _run(script, pace=0.0):
+    # `script` is (ms, code, value) frames, the output is (ms, code, value) relative to 100s
+    clock = VirtualClock(100.0)
+    sink = EventSink(keep=True)
+    pipeline = compile_pipeline([(MacroLayer, {'macros': _MACROS, 'pace': pace})], sink, clock)
+
+    events = []
+    for ms, code, value in script:
+        events.append(InputEvent(100, ms * 1000, ecodes.EV_KEY, code, value))
+        events.append(InputEvent(100, ms * 1000, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    asyncio.run(replay(events, pipeline, clock=clock))
+    return [
+        (round((e.timestamp() - 100) * 1000), e.code, e.value)
+        for e in sink.events if e.type == ecodes.EV_KEY
+    ]
+
+
+def _keys(output):
+    return [(code, value) for _, code, value in output]
+
+
+_HI = [(H, 1), (H, 0), (I, 1), (I, 0), (SHIFT, 1), (ONE, 1), (ONE, 0), (SHIFT, 0)]
+
+
+def test_trigger_types_its_sequence_and_chords():
+    # the trigger itself never goes out, chords are released in reverse
+    assert _keys(_run([(0, F1, 1), (10, F1, 2), (50, F1, 0)])) == _HI
+
+
+def test_other_keys_pass_through():
+    assert _keys(_run([(0, A, 1), (10, A, 0)])) == [(A, 1), (A, 0)]
+
+
+def test_unpaced_macro_plays_in_one_burst():
+    output = _run([(0, F1, 1), (10, F1, 0)])
+    assert {ms for ms, _, _ in output} == {0}
+
+
+def test_long_unpaced_macro_is_typed_across_bursts():
+    macros = {'KEY_F2': ['KEY_A', 'KEY_H'] * MACRO_BURST}
+    clock = VirtualClock(100.0)
+    sink = EventSink(keep=True)
+    pipeline = compile_pipeline([(MacroLayer, {'macros': macros})], sink, clock)
+
+    asyncio.run(replay([InputEvent(100, 0, ecodes.EV_KEY, F2, 1)], pipeline, clock=clock))
+
+    keys = [(e.code, e.value) for e in sink.events if e.type == ecodes.EV_KEY]
+    assert keys == [(A, 1), (A, 0), (H, 1), (H, 0)] * MACRO_BURST
+
+
+def test_paced_macro_types_a_chord_per_pace():
+    output = _run([(0, F1, 1), (10, F1, 0)], pace=0.02)
+    assert _keys(output) == _HI
+    assert [ms for ms, _, value in output if value == 1] == [20, 40, 60, 60]
+
+
+def test_macro_triggered_while_playing_is_queued_after_it():
+    output = _run([(0, F1, 1), (5, F2, 1), (6, F2, 0), (7, A, 1), (8, A, 0)], pace=0.02)
+
+    # the plain A passes straight through, the F2 macro's A follows the F1 sequence
+    assert _keys(output) == [(A, 1), (A, 0)] + _HI + [(A, 1), (A, 0)]
+    assert output[-2][0] == 80
@@ -0,0 +1,38 @@
+import asyncio
+
+from evdev import InputEvent, ecodes
+
+import metrics
+from clock import VirtualClock
+from pipeline import compile_pipeline
+from replay import EventSink, replay
+from tap_hold import TapHoldLayer
+
+
+_LAYER = (TapHoldLayer, {'mods': {'KEY_A': 'KEY_LEFTCTRL'}})
+
+
+def _tap(pipeline, clock):
+    events = []
+    for usec, value in ((0, 1), (10_000, 0)):
+        events.append(InputEvent(100, usec, ecodes.EV_KEY, ecodes.KEY_A, value))
+        events.append(InputEvent(100, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+    asyncio.run(replay(events, pipeline, clock=clock))
+
+
+def test_rebuilt_stacks_keep_counting():
+    metrics.enable()
+    try:
+        for device in ('kb', 'kb', 'kb', 'pad'):
+            clock = VirtualClock(100.0)
+            _tap(compile_pipeline([_LAYER], EventSink(), clock, device=device), clock)
+
+        assert list(metrics.stats.layers) == [('kb', 'TapHoldLayer#0'), ('pad', 'TapHoldLayer#0')]
+
+        decisions = {
+            (labels['device'], labels['decision']): value
+            for name, labels, value in metrics.stats.samples() if name == 'kbfn_layer_decisions_total'
+        }
+        assert decisions == {('kb', 'tap'): 3, ('kb', 'hold'): 0, ('pad', 'tap'): 1, ('pad', 'hold'): 0}
+    finally:
+        metrics.stats = None
@@ -0,0 +1,56 @@
+import asyncio
+
+from evdev import InputEvent, ecodes
+
+from clock import VirtualClock
+from pipeline import compile_pipeline
+from remap_layer import RemapLayer
+from replay import EventSink, replay
+
+
+def _run(layers, keys):
+    # `keys` are (code, value), one frame each, 10ms apart
+    clock = VirtualClock(100.0)
+    sink = EventSink(keep=True)
+    pipeline = compile_pipeline(layers, sink, clock)
+
+    events = []
+    for i, (code, value) in enumerate(keys):
+        sec, usec = 100, i * 10_000
+        events.append(InputEvent(sec, usec, ecodes.EV_KEY, code, value))
+        events.append(InputEvent(sec, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    asyncio.run(replay(events, pipeline, clock=clock))
+    return [(e.code, e.value) for e in sink.events if e.type == ecodes.EV_KEY]
+
+
+def _tap(code):
+    return [(code, 1), (code, 0)]
+
+
+def test_remaps_compose_in_stack_order():
+    a_to_b = (RemapLayer, {'codes': {ecodes.KEY_A: ecodes.KEY_B}})
+    b_to_c = (RemapLayer, {'codes': {ecodes.KEY_B: ecodes.KEY_C}})
+
+    assert _run([a_to_b, b_to_c], _tap(ecodes.KEY_A)) == _tap(ecodes.KEY_C)
+    assert _run([b_to_c, a_to_b], _tap(ecodes.KEY_A)) == _tap(ecodes.KEY_B)
+    assert _run([a_to_b, b_to_c], _tap(ecodes.KEY_B)) == _tap(ecodes.KEY_C)
+
+
+def test_unmapped_keys_and_other_events_pass_through():
+    clock = VirtualClock(100.0)
+    sink = EventSink(keep=True)
+    pipeline = compile_pipeline([(RemapLayer, {'codes': {ecodes.KEY_A: ecodes.KEY_B}})], sink, clock)
+
+    events = [
+        InputEvent(100, 0, ecodes.EV_MSC, ecodes.MSC_SCAN, 30),
+        InputEvent(100, 0, ecodes.EV_KEY, ecodes.KEY_X, 1),
+        InputEvent(100, 0, ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+    ]
+    asyncio.run(replay(events, pipeline, clock=clock))
+
+    assert [(e.type, e.code, e.value) for e in sink.events] == [
+        (ecodes.EV_MSC, ecodes.MSC_SCAN, 30),
+        (ecodes.EV_KEY, ecodes.KEY_X, 1),
+        (ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+    ]
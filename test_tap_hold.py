@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+from evdev import InputEvent, ecodes
+
+from clock import Clock, VirtualClock
+from pipeline import compile_pipeline
+from replay import EventSink, replay
+from tap_hold import TapHoldLayer
+
+
+A, F, J, X, SPACE = ecodes.KEY_A, ecodes.KEY_F, ecodes.KEY_J, ecodes.KEY_X, ecodes.KEY_SPACE
+LEFTMETA, RIGHTSHIFT = ecodes.KEY_LEFTMETA, ecodes.KEY_RIGHTSHIFT
+
+_LAYER = (TapHoldLayer, {
+    'mods': {A: LEFTMETA, J: RIGHTSHIFT},
+    'fn_layers': {SPACE: {J: ecodes.KEY_LEFT}},
+})
+
+
+def _run(script, layers=(_LAYER,)):
+    # `script` is (ms, code, value) frames
+    clock = VirtualClock(100.0)
+    sink = EventSink(keep=True)
+    pipeline = compile_pipeline(layers, sink, clock)
+
+    events = []
+    for ms, code, value in script:
+        sec, usec = 100, ms * 1000
+        events.append(InputEvent(sec, usec, ecodes.EV_KEY, code, value))
+        events.append(InputEvent(sec, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    asyncio.run(replay(events, pipeline, clock=clock))
+    return sink.events
+
+
+def _keys(events):
+    return [(e.code, e.value) for e in events if e.type == ecodes.EV_KEY]
+
+
+def test_tap():
+    assert _keys(_run([(0, A, 1), (100, A, 0)])) == [(A, 1), (A, 0)]
+
+
+def test_hold_past_the_threshold():
+    assert _keys(_run([(0, A, 1), (600, A, 0)])) == [(LEFTMETA, 1), (LEFTMETA, 0)]
+
+
+def test_another_key_tapped_inside_is_a_hold():
+    assert _keys(_run([(0, A, 1), (10, X, 1), (20, X, 0), (30, A, 0)])) == [
+        (LEFTMETA, 1), (X, 1), (X, 0), (LEFTMETA, 0),
+    ]
+
+
+def test_roll_is_a_tap():
+    assert _keys(_run([(0, A, 1), (10, X, 1), (30, A, 0), (40, X, 0)])) == [
+        (A, 1), (A, 0), (X, 1), (X, 0),
+    ]
+
+
+def test_first_key_held_past_the_delay_is_a_hold():
+    assert _keys(_run([(0, A, 1), (10, X, 1), (100, X, 0), (110, A, 0)])) == [
+        (LEFTMETA, 1), (X, 1), (X, 0), (LEFTMETA, 0),
+    ]
+
+
+def test_hold_decided_from_a_late_read_is_stamped_with_its_deadline():
+    # events read late: the timer fires from `advance`, with the wall clock well past it
+    async def main():
+        clock = Clock()
+        sink = EventSink(keep=True)
+        pipeline = compile_pipeline([_LAYER], sink, clock)
+
+        start = int(time.time()) - 1
+        for usec, code, value in ((0, A, 1), (10_000, X, 1), (100_000, X, 0)):
+            clock.advance(start + usec / 1_000_000)
+            pipeline.send(InputEvent(start, usec, ecodes.EV_KEY, code, value))
+
+        return start, sink.events
+
+    start, events = asyncio.run(main())
+    assert [e.code for e in events[:2]] == [LEFTMETA, X]
+    assert abs(events[0].timestamp() - (start + 0.06)) < 1e-5
+
+
+def test_repeats_of_a_key_held_before_dont_decide():
+    script = [
+        (0, X, 1), (300, X, 2),
+        (400, A, 1), (405, X, 2), (410, J, 1), (415, X, 2), (420, A, 0), (425, X, 2), (430, J, 0),
+        (500, X, 0),
+    ]
+    assert [k for k in _keys(_run(script)) if k[0] != X] == [(A, 1), (A, 0), (J, 1), (J, 0)]
+
+
+def test_fn_layer_remaps_tap_hold_keys():
+    assert _keys(_run([(0, SPACE, 1), (10, J, 1), (20, J, 0), (30, SPACE, 0)])) == [
+        (ecodes.KEY_LEFT, 1), (ecodes.KEY_LEFT, 0),
+    ]
@@ -0,0 +1,85 @@
+import sys
+from array import array
+from functools import partial
+from typing import Callable, Dict, List, Optional, TextIO
+
+from evdev import InputEvent, ecodes
+
+
+class TraceRing:
+    # fixed size ring of (timestamp, layer id, type, code, value) records
+
+    def __init__(self, size: int):
+        self.size = size
+        self.count = 0
+
+        self._ts = array('d', bytes(8 * size))
+        self._layer = array('H', bytes(2 * size))
+        self._type = array('H', bytes(2 * size))
+        self._code = array('H', bytes(2 * size))
+        self._value = array('i', bytes(4 * size))
+
+        self._layers: List[str] = []
+        self._ids: Dict[str, int] = {}
+
+    def register(self, label: str) -> int:
+        # stacks rebuilt for the same device reuse the ids of the layers they replace
+        layer_id = self._ids.get(label)
+        if layer_id is None:
+            layer_id = self._ids[label] = len(self._layers)
+            self._layers.append(label)
+        return layer_id
+
+    def record(self, layer_id: int, event: InputEvent):
+        i = self.count % self.size
+        self.count += 1
+
+        self._ts[i] = event.sec + event.usec * 1e-6
+        self._layer[i] = layer_id
+        self._type[i] = event.type
+        self._code[i] = event.code
+        self._value[i] = event.value
+
+    def dump(self, file: TextIO = sys.stderr):
+        start = max(0, self.count - self.size)
+
+        for n in range(start, self.count):
+            i = n % self.size
+            etype, code = self._type[i], self._code[i]
+
+            if etype == ecodes.EV_KEY:
+                name = ecodes.keys.get(code, code)
+                name = name[0] if isinstance(name, list) else name
+            else:
+                name = code
+
+            file.write('%.6f\t%s\t%s\t%s\t%d\n' % (
+                self._ts[i],
+                self._layers[self._layer[i]],
+                ecodes.EV.get(etype, etype),
+                name,
+                self._value[i],
+            ))
+
+        file.flush()
+
+
+ring: Optional[TraceRing] = None
+
+
+def enable(size: int):
+    global ring
+    ring = TraceRing(size)
+
+
+def tracer(label: str) -> Optional[Callable[[InputEvent], None]]:
+    # layers keep the result and call it per event, `None` when tracing is off
+    if ring is None:
+        return None
+
+    return partial(ring.record, ring.register(label))
+
+
+def dump():
+    if ring is not None:
+        ring.dump()